@@ -2,34 +2,87 @@
 """Build Nearest Neighbor Search index recipe script"""
 
 import os
-from tempfile import NamedTemporaryFile
+from contextlib import ExitStack
+from io import BytesIO
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from time import perf_counter
+
+import numpy as np
 
 from dku_param_loading import load_indexing_recipe_params
 from data_loader import DataLoader
+from dimensionality_reduction import DimensionalityReduction
 from nearest_neighbor.base import NearestNeighborSearch
-from dku_io_utils import save_array_to_folder
+from dku_io_utils import ArtifactWriter, save_performance_report, spill_dataset_to_memmap
+from performance_tracking import performance_tracker
 
 # Load parameters
 params = load_indexing_recipe_params()
+performance_tracker.reset(recipe_name="similarity-search-index")
+if params["profiling"]:
+    performance_tracker.start_profiling()
 
-# Load data into array format for indexing
+# Load data into array format for indexing - spilled to a local scratch directory in out-of-core mode
 columns = [params["unique_id_column"]] + params["feature_columns"]
-input_df = params["input_dataset"].get_dataframe(columns=columns, infer_with_pandas=False)
-data_loader = DataLoader(params["unique_id_column"], params["feature_columns"])
-(array_ids, arrays) = data_loader.convert_df_to_arrays(input_df)
-
-# Build index and save index file to output folder
-nearest_neighbor = NearestNeighborSearch(num_dimensions=arrays.shape[1], **params)
-with NamedTemporaryFile() as tmp:
-    nearest_neighbor.build_save_index(arrays=arrays, index_path=tmp.name)
-    index_file_path = os.path.join(params["folder_partition_root"], nearest_neighbor.INDEX_FILE_NAME)
-    params["index_folder"].upload_stream(index_file_path, tmp)
-
-# Save arrays and indexing config to guarantee reproducibility
-array_ids_file_path = os.path.join(params["folder_partition_root"], nearest_neighbor.ARRAY_IDS_FILE_NAME)
-arrays_file_path = os.path.join(params["folder_partition_root"], nearest_neighbor.ARRAYS_FILE_NAME)
+data_loader = DataLoader(params["unique_id_column"], params["feature_columns"], params["input_schema"])
+with ExitStack() as exit_stack:
+    scratch_dir = None
+    if params["out_of_core"]:
+        scratch_dir = exit_stack.enter_context(TemporaryDirectory())
+        (array_ids, arrays, block_size) = spill_dataset_to_memmap(
+            params["input_dataset"],
+            columns,
+            data_loader,
+            scratch_path=os.path.join(scratch_dir, "vectors.f32"),
+            memory_budget_mb=params["memory_budget_mb"],
+        )
+    else:
+        start = perf_counter()
+        input_df = params["input_dataset"].get_dataframe(columns=columns, infer_with_pandas=False)
+        performance_tracker.record("dataset_read", perf_counter() - start, num_items=len(input_df.index))
+        (array_ids, arrays) = data_loader.convert_df_to_arrays(input_df)
+        block_size = len(arrays)
+
+    # Optional dimensionality reduction, fitted on a sample and applied by blocks
+    indexed_arrays = arrays
+    dimensionality_reduction = None
+    if params["dimensionality_reduction"] != "none":
+        dimensionality_reduction = DimensionalityReduction(
+            method=params["dimensionality_reduction"],
+            target_explained_variance=params.get("target_explained_variance"),
+            output_dimensions=params.get("reduction_num_dimensions"),
+        ).fit(arrays, memory_budget_mb=params.get("memory_budget_mb"))
+        reduced_arrays = None
+        if scratch_dir is not None:
+            reduced_arrays = np.memmap(
+                os.path.join(scratch_dir, "reduced_vectors.f32"),
+                dtype=np.float32,
+                mode="w+",
+                shape=(len(arrays), dimensionality_reduction.output_dimensions),
+            )
+        indexed_arrays = dimensionality_reduction.transform(arrays, out=reduced_arrays)
+
+    # Build index while arrays are compressed and uploaded concurrently, then upload index file to output folder
+    nearest_neighbor = NearestNeighborSearch(num_dimensions=indexed_arrays.shape[1], **params)
+    with NamedTemporaryFile() as tmp, ArtifactWriter(params["index_folder"], params["folder_partition_root"]) as writer:
+        # Save arrays to guarantee reproducibility
+        writer.save_array(array_ids, nearest_neighbor.ARRAY_IDS_FILE_NAME)
+        writer.save_array(arrays, nearest_neighbor.ARRAYS_FILE_NAME)
+        nearest_neighbor.build_save_index(arrays=indexed_arrays, index_path=tmp.name, block_size=block_size)
+        writer.upload_file(tmp.name, nearest_neighbor.INDEX_FILE_NAME)
+        if dimensionality_reduction is not None:
+            reduction_buffer = BytesIO()
+            dimensionality_reduction.save(reduction_buffer)
+            writer.upload_bytes(reduction_buffer.getvalue(), dimensionality_reduction.FILE_NAME)
+    del arrays, indexed_arrays  # close memory maps before the scratch directory is removed
+
+# Save indexing config last, once all files it references are uploaded
 config_file_path = os.path.join(params["folder_partition_root"], nearest_neighbor.CONFIG_FILE_NAME)
-save_array_to_folder(array=array_ids, path=array_ids_file_path, folder=params["index_folder"])
-save_array_to_folder(array=arrays, path=arrays_file_path, folder=params["index_folder"])
 config = {**nearest_neighbor.get_config(), **{k: v for k, v in params.items() if k in {"feature_columns", "expert"}}}
+if dimensionality_reduction is not None:
+    config["dimensionality_reduction"] = dimensionality_reduction.get_config()
 params["index_folder"].write_json(config_file_path, config)
+
+# Save performance report of this run next to the index
+if params["performance_report"]:
+    save_performance_report(performance_tracker, params["index_folder"], params["folder_partition_root"])
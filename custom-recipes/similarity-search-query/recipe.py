@@ -1,32 +1,77 @@
 # -*- coding: utf-8 -*-
 """Find Nearest Neighbors recipe script"""
 
-import os
+import logging
 
 from dku_param_loading import load_search_recipe_params
-from nearest_neighbor.base import NearestNeighborSearch
+from nearest_neighbor.group_search import GroupNearestNeighborSearch
+from nearest_neighbor.multi_index import MultiIndexNearestNeighborSearch
 from dku_io_utils import (
-    download_file_from_folder_to_tmp,
-    load_array_from_folder,
+    load_index_from_folder,
     process_dataset_chunks,
     set_column_descriptions,
+    save_performance_report,
 )
+from performance_tracking import performance_tracker
 
 # Load parameters
 params = load_search_recipe_params()
+performance_tracker.reset(recipe_name="similarity-search-query")
+if params["profiling"]:
+    performance_tracker.start_profiling()
 
-# Load pre-computed index and arra ids
-config_file_path = os.path.join(params["folder_partition_root"], NearestNeighborSearch.CONFIG_FILE_NAME)
-index_config = params["index_folder"].read_json(config_file_path)
-nearest_neighbor = NearestNeighborSearch(**index_config)
-index_file_path = os.path.join(params["folder_partition_root"], nearest_neighbor.INDEX_FILE_NAME)
-with download_file_from_folder_to_tmp(index_file_path, params["index_folder"]) as tmp:
-    nearest_neighbor.load_index(tmp.name)
-array_ids_file_path = os.path.join(params["folder_partition_root"], nearest_neighbor.ARRAY_IDS_FILE_NAME)
-index_array_ids = load_array_from_folder(array_ids_file_path, params["index_folder"])
+# Load pre-computed indices and array ids, by index folder name - checked to be distinct when loading parameters
+indices = {
+    index_folder.get_name(): load_index_from_folder(index_folder, folder_partition_root)
+    for index_folder, folder_partition_root in zip(params["index_folders"], params["folder_partition_roots"])
+}
 
-# Find nearest neighbors in input dataset
-process_dataset_chunks(func=nearest_neighbor.find_neighbors_df, index_array_ids=index_array_ids, **params)
+# Find nearest neighbors in input dataset - parsed once even if there are several indices, optionally by group
+if params["group_column"] is not None:
+    (nearest_neighbor, index_array_ids) = list(indices.values())[0]
+    group_nearest_neighbor = GroupNearestNeighborSearch(
+        nearest_neighbor, index_array_ids, params["group_column"], params["group_aggregation"]
+    )
+    array_column_types = group_nearest_neighbor.get_array_column_types(
+        params["output_format"], params["neighbor_id_type"]
+    )
+    process_dataset_chunks(
+        func=group_nearest_neighbor.find_neighbors_df, array_column_types=array_column_types, **params
+    )
+    column_descriptions = group_nearest_neighbor.get_column_descriptions(
+        params["output_format"], params["neighbor_id_type"]
+    )
+elif len(indices) == 1:
+    (nearest_neighbor, index_array_ids) = list(indices.values())[0]
+    array_column_types = nearest_neighbor.get_array_column_types(
+        index_array_ids, params["output_format"], params["neighbor_id_type"]
+    )
+    process_dataset_chunks(
+        func=nearest_neighbor.find_neighbors_df,
+        index_array_ids=index_array_ids,
+        array_column_types=array_column_types,
+        **params,
+    )
+    column_descriptions = nearest_neighbor.get_column_descriptions(params["output_format"], params["neighbor_id_type"])
+else:
+    with MultiIndexNearestNeighborSearch(indices, params["multi_index_output"]) as multi_index_nearest_neighbor:
+        array_column_types = multi_index_nearest_neighbor.get_array_column_types(
+            params["output_format"], params["neighbor_id_type"]
+        )
+        process_dataset_chunks(
+            func=multi_index_nearest_neighbor.find_neighbors_df, array_column_types=array_column_types, **params
+        )
+        column_descriptions = multi_index_nearest_neighbor.get_column_descriptions(
+            params["output_format"], params["neighbor_id_type"]
+        )
 
 # Add column descriptions to the output dataset
-set_column_descriptions(params["output_dataset"], nearest_neighbor.COLUMN_DESCRIPTIONS)
+set_column_descriptions(params["output_dataset"], column_descriptions)
+
+# Save performance report of this run to the optional report folder
+if params["performance_report"]:
+    if params["report_folder"] is not None:
+        save_performance_report(performance_tracker, params["report_folder"], params["report_folder_partition_root"])
+    else:
+        logging.warning("No report folder specified as output: performance report is only logged")
+        performance_tracker.log_report()
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""Module to adapt the size of dataset chunks at runtime - *not* based on the Dataiku API"""
+
+import logging
+from typing import AnyStr, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+
+class AdaptiveChunkScheduler:
+    """Grow or shrink the number of rows per chunk toward maximum throughput within a memory budget
+
+    Starting from an initial size, the chunk size is multiplied by GROWTH_FACTOR as long as rows per second improve
+    by at least MIN_THROUGHPUT_GAIN and the memory of the next chunk, extrapolated from the last one, fits the budget.
+    Once throughput stops improving, it settles on the best size seen.
+    If a chunk exceeds the memory budget, it shrinks and searches for the best size again,
+    so that it recovers once memory per row is back to normal.
+    """
+
+    GROWTH_FACTOR = 2
+    MIN_THROUGHPUT_GAIN = 1.05  # noise margin between two measurements of rows per second
+
+    def __init__(
+        self,
+        initial_chunksize: int = 1000,
+        memory_budget_mb: float = 1024,
+        min_chunksize: int = 100,
+        max_chunksize: int = 2 ** 20,
+    ):
+        self.chunksize = initial_chunksize
+        self.memory_budget_mb = memory_budget_mb
+        self.min_chunksize = min_chunksize
+        self.max_chunksize = max_chunksize
+        self.best_chunksize = initial_chunksize
+        self.best_rows_per_second = 0.0
+        self.converged = False
+        self.history = []  # list of measurements of each chunk, for logging and tuning
+        self.group_column = None  # set by `iter_chunks` when chunking by group
+        self._previous_last_group = None  # group of the last row of the previous chunk, when chunking by group
+
+    def _fit_memory_budget(self, chunksize: int, memory_mb_per_row: float) -> int:
+        """Cap a chunk size so that its extrapolated memory fits the budget"""
+        if memory_mb_per_row > 0:
+            chunksize = min(chunksize, int(self.memory_budget_mb / memory_mb_per_row))
+        return max(self.min_chunksize, min(chunksize, self.max_chunksize))
+
+    def update(self, num_rows: int, seconds: float, memory_mb: float, phase_seconds: Dict = None) -> int:
+        """Record the measurements of a processed chunk and return the size of the next chunk
+
+        Args:
+            num_rows: Number of rows of the chunk
+            seconds: Wall-clock time to read, process and write the chunk
+            memory_mb: Memory used by the chunk alone, e.g. estimated with `estimate_memory_mb`
+            phase_seconds: Optional breakdown of `seconds` by phase, for logging
+
+        """
+        rows_per_second = num_rows / max(seconds, 1e-9)
+        memory_mb_per_row = max(memory_mb, 0.0) / max(num_rows, 1)
+        self.history.append(
+            {
+                "chunksize": num_rows,
+                "seconds": round(seconds, 6),
+                "rows_per_second": round(rows_per_second, 2),
+                "memory_mb": round(memory_mb, 2),
+                "phase_seconds": {name: round(value, 6) for name, value in (phase_seconds or {}).items()},
+            }
+        )
+        logging.debug(f"Chunk measurements: {self.history[-1]}")
+        previous_chunksize = self.chunksize
+        if self.group_column is None and num_rows < self.chunksize:  # last partial chunk
+            return self.chunksize
+        if self.group_column is not None and num_rows < self.chunksize // self.GROWTH_FACTOR:  # cut short by a group
+            return self.chunksize
+        if memory_mb > self.memory_budget_mb:
+            self.chunksize = self._fit_memory_budget(self.chunksize // self.GROWTH_FACTOR, memory_mb_per_row)
+            (self.best_chunksize, self.best_rows_per_second) = (self.chunksize, 0.0)
+            self.converged = False
+            reason = f"memory {memory_mb:.0f} MB over budget of {self.memory_budget_mb} MB"
+        elif len(self.history) == 1:  # first chunk includes warm-up costs so it is not compared
+            self.chunksize = self._fit_memory_budget(self.chunksize * self.GROWTH_FACTOR, memory_mb_per_row)
+            reason = "first chunk"
+        elif self.converged:
+            return self.chunksize
+        elif rows_per_second > self.best_rows_per_second * self.MIN_THROUGHPUT_GAIN:
+            (self.best_chunksize, self.best_rows_per_second) = (self.chunksize, rows_per_second)
+            self.chunksize = self._fit_memory_budget(self.chunksize * self.GROWTH_FACTOR, memory_mb_per_row)
+            self.converged = self.chunksize == previous_chunksize
+            reason = f"throughput improved to {rows_per_second:.0f} rows/s"
+        else:
+            self.chunksize = self.best_chunksize
+            self.converged = True
+            reason = f"throughput did not improve ({rows_per_second:.0f} rows/s), keeping best size"
+        if self.chunksize != previous_chunksize:
+            logging.info(f"Chunk size changed from {previous_chunksize} to {self.chunksize} rows: {reason}")
+        return self.chunksize
+
+    @staticmethod
+    def estimate_memory_mb(*dfs: pd.DataFrame, allocated_bytes: int = 0) -> float:
+        """Memory used by a chunk in megabytes, including strings
+
+        Sum the input and output DataFrames and the bytes of arrays allocated to process the chunk,
+        e.g. parsed vectors and search results, counted by the performance tracker.
+        """
+        dataframe_bytes = sum(float(df.memory_usage(index=False, deep=True).sum()) for df in dfs)
+        return (dataframe_bytes + allocated_bytes) / 1024 ** 2
+
+    @staticmethod
+    def _find_chunk_end(df: pd.DataFrame, chunksize: int, group_column: AnyStr = None) -> Optional[int]:
+        """Position where to cut a chunk: the chunk size, or the last change of group before it if any"""
+        if group_column is None:
+            return chunksize
+        group_values = df[group_column].values
+        group_starts = np.flatnonzero(group_values[1:] != group_values[:-1]) + 1
+        if len(group_starts) == 0:
+            return None  # all rows belong to the same group, which may continue in the next rows
+        group_starts_before = group_starts[group_starts <= chunksize]
+        return int(group_starts_before[-1] if len(group_starts_before) else group_starts[0])
+
+    def _check_contiguous_groups(self, df: pd.DataFrame, group_column: AnyStr) -> None:
+        """Raise if a group of a chunk is split in several runs or continues the last group of the previous chunk
+
+        Only the last group of the previous chunk is kept, so that memory does not grow with the number of groups.
+        """
+        group_values = df[group_column].values
+        if len(group_values) == 0:
+            return
+        run_starts = np.concatenate(([0], np.flatnonzero(group_values[1:] != group_values[:-1]) + 1))
+        run_groups = group_values[run_starts]
+        split_groups = run_groups[pd.Series(run_groups).duplicated().values]
+        if self._previous_last_group is not None and run_groups[0] == self._previous_last_group:
+            split_groups = run_groups[:1]
+        if len(split_groups):
+            raise ValueError(
+                f"Rows of the same group are not contiguous in column '{group_column}', e.g. '{split_groups[0]}'"
+                + ": please sort the input dataset by this column"
+            )
+        self._previous_last_group = group_values[-1]
+
+    def iter_chunks(self, df_iterator: Iterator[pd.DataFrame], group_column: AnyStr = None) -> Iterator[pd.DataFrame]:
+        """Regroup DataFrames of any size into chunks of the current chunk size, read before yielding each chunk
+
+        If a group column is given, rows of the same group are never split across chunks:
+        each chunk is cut at the last change of group before the chunk size.
+        Groups must be contiguous, e.g. sorted by the group column. A ValueError is raised if a group is split
+        within a chunk, or if it continues right at the start of the next chunk. A group which reappears after
+        other chunks is not detected, as only the last group of the previous chunk is kept.
+        """
+        (self.group_column, self._previous_last_group) = (group_column, None)
+        buffer: List[pd.DataFrame] = []
+        num_buffered_rows = 0
+        for df in df_iterator:
+            buffer.append(df)
+            num_buffered_rows += len(df.index)
+            while num_buffered_rows >= self.chunksize:
+                df = pd.concat(buffer, ignore_index=True) if len(buffer) > 1 else buffer[0]
+                chunk_end = self._find_chunk_end(df, self.chunksize, group_column)
+                if chunk_end is None:  # read more rows until the end of the group
+                    buffer = [df]
+                    break
+                buffer = [df.iloc[chunk_end:]] if len(df.index) > chunk_end else []
+                num_buffered_rows = len(df.index) - chunk_end
+                if group_column is not None:
+                    self._check_contiguous_groups(df.iloc[:chunk_end], group_column)
+                yield df.iloc[:chunk_end]
+        if num_buffered_rows:
+            df = pd.concat(buffer, ignore_index=True) if len(buffer) > 1 else buffer[0]
+            if group_column is not None:
+                self._check_contiguous_groups(df, group_column)
+            yield df
+
+    def log_summary(self) -> None:
+        """Log the range of chunk sizes used, to help choose a fixed size for similar datasets"""
+        chunksizes = [measurement["chunksize"] for measurement in self.history]
+        logging.info(
+            f"Adaptive chunking: {len(chunksizes)} chunks of {min(chunksizes, default=0)} "
+            + f"to {max(chunksizes, default=0)} rows, settled on {self.chunksize} rows"
+        )
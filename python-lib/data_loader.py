@@ -3,21 +3,51 @@
 
 import json
 import logging
-from typing import List, AnyStr, Tuple
+from typing import List, AnyStr, Dict, Tuple
 from time import perf_counter
 
 import pandas as pd
 import numpy as np
 
+from performance_tracking import performance_tracker
+
 
 class DataLoader:
-    """Data loading class to convert numeric/array data from pandas DataFrames into numpy.arrays"""
+    """Data loading class to convert numeric/array data from pandas DataFrames into numpy.arrays
+
+    The kind of each feature column (numeric or array) and the length of array columns are detected once,
+    from the dataset schema if available or else from the first DataFrame, then reused for each subsequent chunk.
+    Empty values and parse errors are detected while decoding, without separate validation passes.
+    Array columns are decoded by batches of DECODE_BATCH_SIZE rows, so that the temporary Python lists
+    stay small whatever the size of the DataFrame. The arrays and this decoding buffer are counted
+    by the performance tracker, as they are not part of the DataFrame memory.
+    """
 
     MAX_ARRAY_LENGTH = 2 ** 16  # hardcoded limit to keep array size under 65536
+    DECODE_BATCH_SIZE = 256  # rows decoded with one JSON parsing call
+    DECODE_BYTES_PER_VALUE = 32  # Python float and list pointer of each decoded array value
+    NUMERIC_COLUMN_TYPES = {"tinyint", "smallint", "int", "bigint", "float", "double"}
 
-    def __init__(self, unique_id_column: AnyStr, feature_columns: List[AnyStr]):
+    def __init__(
+        self,
+        unique_id_column: AnyStr,
+        feature_columns: List[AnyStr],
+        input_schema: List[Dict] = None,
+        unique_ids: bool = True,
+    ):
         self.unique_id_column = unique_id_column
+        self.unique_ids = unique_ids  # False when ids are group ids shared by several rows
         self.feature_columns = feature_columns
+        self.column_kinds = {}  # "numeric" or "array" by column name
+        self.column_lengths = {}  # array length by column name
+        if input_schema:
+            column_types = {column.get("name"): column.get("type") for column in input_schema}
+            for column in feature_columns:
+                if column_types.get(column) in self.NUMERIC_COLUMN_TYPES:
+                    self.column_kinds[column] = "numeric"
+                elif column_types.get(column) == "array":
+                    self.column_kinds[column] = "array"
+                # string columns may hold numbers or stringified lists: detected on the first DataFrame
 
     @staticmethod
     def load_array_from_string(string: AnyStr) -> np.array:
@@ -30,14 +60,11 @@ class DataLoader:
             raise ValueError(f"string '{string}' is not a list")
 
     def _validate_df(self, df: pd.DataFrame):
-        """Make sure that the DataFrame is not empty and has a unique ID column"""
+        """Make sure that the DataFrame is not empty and has a unique ID column, unless ids are group ids"""
         if len(df.index) == 0:
             raise ValueError("Input dataset is empty")
-        if not df[self.unique_id_column].is_unique:
+        if self.unique_ids and not df[self.unique_id_column].is_unique:
             raise ValueError(f"Values in the unique ID column '{self.unique_id_column}' should be unique")
-        for column in self.feature_columns:
-            if df[column].isnull().values.any():
-                raise ValueError(f"Empty values in column '{column}'")
 
     def convert_df_to_arrays(self, df: pd.DataFrame, verbose: bool = True) -> Tuple[np.array, np.array]:
         """Convert a DataFrame into the array format required by Similarity Search algorithms"""
@@ -48,9 +75,12 @@ class DataLoader:
                 f"Loading dataframe of {len(df.index)} rows and "
                 + f"{len(self.feature_columns)} column(s) into array format..."
             )
-        array_ids = df[self.unique_id_column].values
-        array_length = self._count_array_length(df)
-        arrays = self._load_arrays_from_df(df, array_length)
+        with performance_tracker.phase("vector_parsing", num_items=len(df.index)):
+            array_ids = df[self.unique_id_column].values
+            if len(self.column_lengths) != len(self.feature_columns):
+                self._detect_columns(df)
+            arrays = self._load_arrays_from_df(df)
+            performance_tracker.record_allocation(arrays.nbytes + self.get_decode_buffer_bytes(len(df.index)))
         if verbose:
             logging.info(
                 f"Loading dataframe into array format: dimensions {arrays.shape} "
@@ -58,31 +88,79 @@ class DataLoader:
             )
         return (array_ids, arrays)
 
-    def _load_arrays_from_df(self, df: pd.DataFrame, array_length: int) -> np.array:
-        """Concatenate numeric/array columns of DataFrame into a single numpy.array"""
-        arrays = np.empty(shape=(len(df.index), array_length))  # pre-allocate empty array of fixed size
-        i = 0
+    def get_decode_buffer_bytes(self, num_rows: int) -> int:
+        """Size of the temporary Python lists used to decode array columns, bounded by the decoding batch size"""
+        num_array_values = sum(
+            self.column_lengths[column] for column in self.feature_columns if self.column_kinds[column] == "array"
+        )
+        return min(num_rows, self.DECODE_BATCH_SIZE) * num_array_values * self.DECODE_BYTES_PER_VALUE
+
+    def _detect_columns(self, df: pd.DataFrame) -> None:
+        """Detect the kind and length of each feature column from the first row, once per run"""
         for column in self.feature_columns:
-            column_is_array = df[column].dtype == "object" and df[column].str.startswith("[").all()
-            if column_is_array:
+            first_value = df[column].iloc[0]
+            if pd.isnull(first_value):
+                raise ValueError(f"Empty values in column '{column}'")
+            if column not in self.column_kinds:
+                is_array = isinstance(first_value, str) and first_value.lstrip().startswith("[")
+                self.column_kinds[column] = "array" if is_array else "numeric"
+            if self.column_kinds[column] == "array":
                 try:
-                    column_array = np.stack(df[column].apply(self.load_array_from_string), axis=0)
-                    arrays[:, i : (i + column_array.shape[1])] = column_array  # noqa
-                    i += column_array.shape[1]
-                except ValueError as e:
+                    self.column_lengths[column] = len(self.load_array_from_string(first_value))
+                except (TypeError, ValueError) as e:
                     raise ValueError(f"Invalid array data in column '{column}': {e}")
+            else:
+                self.column_lengths[column] = 1
+        array_length = sum(self.column_lengths.values())
+        if array_length > self.MAX_ARRAY_LENGTH:
+            raise ValueError(f"Concatenated array length {array_length} is above the limit of {self.MAX_ARRAY_LENGTH}")
+        logging.info(f"Concatenated array length: {array_length}")
+
+    def _load_arrays_from_df(self, df: pd.DataFrame) -> np.array:
+        """Concatenate numeric/array columns of DataFrame into a single numpy.array"""
+        arrays = np.empty(shape=(len(df.index), sum(self.column_lengths.values())), dtype=np.float32)
+        i = 0
+        for column in self.feature_columns:
+            column_length = self.column_lengths[column]
+            if self.column_kinds[column] == "array":
+                self._load_array_column(df[column], arrays[:, i : (i + column_length)])  # noqa
             else:
                 try:
                     arrays[:, i] = df[column].values.astype(np.float32)
-                    i += 1
-                except ValueError as e:
+                except (TypeError, ValueError) as e:
                     raise ValueError(f"Invalid numeric data in column '{column}': {e}")
-        arrays = np.ascontiguousarray(arrays[:, :i], dtype=np.float32)
+                if np.isnan(arrays[:, i]).any():
+                    raise ValueError(f"Empty values in column '{column}'")
+            i += column_length
         return arrays
 
-    def _count_array_length(self, df: pd.DataFrame) -> int:
-        """Compute the concatenated array length of a DataFrame with multiple numeric/array columns"""
-        first_array = self._load_arrays_from_df(df.head(1), self.MAX_ARRAY_LENGTH)
-        array_length = first_array.shape[1]
-        logging.info(f"Concatenated array length: {array_length}")
-        return array_length
+    def _load_array_column(self, series: pd.Series, column_array: np.array) -> None:
+        """Decode a column of stringified lists into a slice of the output array, one JSON call per batch of rows"""
+        column_length = column_array.shape[1]
+        values = series.values
+        for start in range(0, len(values), self.DECODE_BATCH_SIZE):
+            batch_values = values[start : (start + self.DECODE_BATCH_SIZE)]  # noqa
+            try:
+                batch_array = np.array(json.loads("[" + ",".join(batch_values) + "]"), dtype=np.float32)
+                if batch_array.shape == (len(batch_values), column_length):
+                    column_array[start : (start + len(batch_values))] = batch_array  # noqa
+                    continue
+            except (TypeError, ValueError):
+                pass
+            self._raise_invalid_array_values(series.name, batch_values, column_length)
+
+    def _raise_invalid_array_values(self, column: AnyStr, values: np.array, column_length: int) -> None:
+        """Slow path only reached on invalid data, to report the first faulty row"""
+        for value in values:
+            if value is None or (isinstance(value, float) and np.isnan(value)):
+                raise ValueError(f"Empty values in column '{column}'")
+            try:
+                array = self.load_array_from_string(value)
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"Invalid array data in column '{column}': {e}")
+            if array.shape != (column_length,):
+                raise ValueError(
+                    f"Invalid array data in column '{column}': "
+                    + f"array of shape {array.shape} instead of length {column_length}"
+                )
+        raise ValueError(f"Invalid array data in column '{column}'")
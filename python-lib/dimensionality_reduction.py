@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Module to reduce the number of dimensions of arrays before indexing - *not* based on the Dataiku API"""
+
+import logging
+from typing import AnyStr, Dict
+
+import numpy as np
+
+from performance_tracking import performance_tracker
+from utils import iter_array_blocks
+
+
+class DimensionalityReduction:
+    """Linear projection of arrays (a.k.a. vectors) to fewer dimensions, fitted on a sample of the indexed arrays
+
+    - PCA keeps the smallest number of principal components reaching a target explained variance ratio
+    - Random projection uses a Gaussian random matrix with a fixed number of output dimensions
+
+    The same fitted transform must be applied to the indexed arrays and to the query arrays.
+    """
+
+    FILE_NAME = "dimensionality_reduction.npz"
+    METHODS = {"pca", "random_projection"}
+    SAMPLE_SIZE = 2 ** 14  # maximum number of rows used to fit the transform
+    MIN_SAMPLE_SIZE = 2 ** 10  # minimum number of rows used to fit the transform, whatever the memory budget
+    FIT_MEMORY_FACTOR = 4  # peak memory of the PCA fit in number of copies of the sample: sample, SVD output, workspace
+    BLOCK_SIZE = 2 ** 14  # number of rows transformed at once
+
+    def __init__(
+        self,
+        method: AnyStr = "pca",
+        target_explained_variance: float = 0.95,
+        output_dimensions: int = None,
+        random_seed: int = 0,
+    ):
+        if method not in self.METHODS:
+            raise NotImplementedError(f"Dimensionality reduction method '{method}' is not available")
+        self.method = method
+        self.target_explained_variance = target_explained_variance
+        self.output_dimensions = output_dimensions
+        self.random_seed = random_seed
+        self.mean = None
+        self.components = None
+        self.explained_variance = None
+
+    @property
+    def input_dimensions(self) -> int:
+        return self.components.shape[1]
+
+    def get_config(self) -> Dict:
+        """Config referenced in the index config.json, the fitted transform is saved separately in FILE_NAME"""
+        return {
+            "method": self.method,
+            "file_name": self.FILE_NAME,
+            "input_dimensions": self.input_dimensions,
+            "output_dimensions": self.output_dimensions,
+            "explained_variance": self.explained_variance,
+        }
+
+    @classmethod
+    def get_sample_size(cls, num_rows: int, input_dimensions: int, memory_budget_mb: float = None) -> int:
+        """Number of rows used to fit the transform, so that the fit stays within a quarter of the memory budget"""
+        sample_size = min(num_rows, cls.SAMPLE_SIZE)
+        if memory_budget_mb is not None:
+            bytes_per_row = cls.FIT_MEMORY_FACTOR * input_dimensions * np.dtype(np.float32).itemsize
+            budget_sample_size = int(memory_budget_mb * 1024 ** 2 / 4 / bytes_per_row)
+            sample_size = min(sample_size, max(budget_sample_size, cls.MIN_SAMPLE_SIZE))
+        return sample_size
+
+    def fit(self, arrays: np.array, memory_budget_mb: float = None) -> "DimensionalityReduction":
+        """Fit the transform on a random sample of rows, in float32 and sized from the optional memory budget"""
+        random_state = np.random.RandomState(self.random_seed)
+        num_rows = self.get_sample_size(len(arrays), arrays.shape[1], memory_budget_mb)
+        sample = np.asarray(arrays[np.sort(random_state.choice(len(arrays), num_rows, replace=False))], np.float32)
+        input_dimensions = sample.shape[1]
+        if self.method == "pca":
+            self.mean = sample.mean(axis=0, dtype=np.float64).astype(np.float32)
+            sample -= self.mean  # centered in place, to avoid another copy of the sample
+            (_, singular_values, components) = np.linalg.svd(sample, full_matrices=False)
+            squared_singular_values = singular_values.astype(np.float64) ** 2
+            explained_variance_ratio = np.cumsum(squared_singular_values) / max(np.sum(squared_singular_values), 1e-12)
+            self.output_dimensions = int(np.searchsorted(explained_variance_ratio, self.target_explained_variance) + 1)
+            self.output_dimensions = min(self.output_dimensions, len(explained_variance_ratio))
+            self.explained_variance = float(explained_variance_ratio[self.output_dimensions - 1])
+            self.components = components[: self.output_dimensions]
+        else:
+            if not self.output_dimensions or self.output_dimensions > input_dimensions:
+                raise ValueError(f"Invalid number of dimensions for random projection: {self.output_dimensions}")
+            self.mean = np.zeros(input_dimensions)
+            self.components = random_state.normal(size=(self.output_dimensions, input_dimensions))
+            self.components /= np.sqrt(self.output_dimensions)
+        self.mean = self.mean.astype(np.float32)
+        self.components = self.components.astype(np.float32)
+        logging.info(
+            f"Fitted {self.method} dimensionality reduction on {num_rows} rows: "
+            + f"{input_dimensions} to {self.output_dimensions} dimensions"
+            + (f", explained variance {self.explained_variance:.3f}" if self.explained_variance else "")
+        )
+        return self
+
+    def transform(self, arrays: np.array, out: np.array = None) -> np.array:
+        """Project arrays by blocks of rows, optionally into a pre-allocated output such as a numpy.memmap"""
+        if arrays.shape[1] != self.input_dimensions:
+            raise ValueError(
+                "Incompatible number of dimensions: "
+                + f"{self.input_dimensions} in dimensionality reduction, {arrays.shape[1]} in arrays"
+            )
+        if out is None:
+            out = np.empty((len(arrays), self.output_dimensions), dtype=np.float32)
+            performance_tracker.record_allocation(out.nbytes)
+        with performance_tracker.phase("dimensionality_reduction", num_items=len(arrays)):
+            start = 0
+            for block in iter_array_blocks(arrays, self.BLOCK_SIZE):
+                out[start : (start + len(block))] = (block - self.mean) @ self.components.T  # noqa
+                start += len(block)
+        return out
+
+    def save(self, file_path: AnyStr) -> None:
+        np.savez(file_path, method=self.method, mean=self.mean, components=self.components)
+
+    @classmethod
+    def load(cls, file_path: AnyStr) -> "DimensionalityReduction":
+        with np.load(file_path) as data:
+            dimensionality_reduction = cls(method=str(data["method"]), output_dimensions=len(data["components"]))
+            dimensionality_reduction.mean = data["mean"]
+            dimensionality_reduction.components = data["components"]
+        return dimensionality_reduction
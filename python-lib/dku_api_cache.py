@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""Module to cache Dataiku API lookups which do not change during a recipe run
+
+Only optional modules (index backends, progress bars) are imported lazily across the plugin:
+pandas and numpy are imported at module level, as the `dataiku` package itself imports them on startup.
+"""
+
+from functools import lru_cache
+from typing import AnyStr, Dict, List
+
+import dataiku
+
+
+@lru_cache(maxsize=None)
+def get_api_client():
+    """Create the public API client once per run, instead of once per call site"""
+    return dataiku.api_client()
+
+
+@lru_cache(maxsize=None)
+def get_project(project_key: AnyStr = None):
+    """Retrieve a project handle - defaults to the project of the current recipe"""
+    return get_api_client().get_project(project_key or dataiku.default_project_key())
+
+
+@lru_cache(maxsize=None)
+def get_folder_definition(folder_id: AnyStr, project_key: AnyStr = None) -> Dict:
+    """Retrieve the definition of a managed folder, including its partitioning config"""
+    return get_project(project_key).get_managed_folder(folder_id).get_definition()
+
+
+_SCHEMA_CACHE = {}
+
+
+def read_input_schema(dataset: dataiku.Dataset) -> List[Dict]:
+    """Read the schema of an input dataset once per run
+
+    Do not use on output datasets, as their schema is written during the run.
+    """
+    if dataset.full_name not in _SCHEMA_CACHE:
+        _SCHEMA_CACHE[dataset.full_name] = dataset.read_schema()
+    return _SCHEMA_CACHE[dataset.full_name]
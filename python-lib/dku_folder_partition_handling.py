@@ -3,6 +3,8 @@
 
 import dataiku
 
+from dku_api_cache import get_folder_definition
+
 
 TIME_DIMENSION_PATTERNS = {"YEAR": "%Y", "MONTH": "%M", "DAY": "%D", "HOUR": "%H"}
 
@@ -20,10 +22,7 @@ def get_folder_partition_root(folder, is_input=False):
     folder_id = folder.get_id()
     input_id = folder_id if is_input else None
     dku_flow_variables = dataiku.get_flow_variables()
-    client = dataiku.api_client()
-    project = client.get_project(dataiku.default_project_key())
-    folder = project.get_managed_folder(folder_id)
-    folder_config = folder.get_definition()
+    folder_config = get_folder_definition(folder_id)
     partitioning_config = folder_config.get("partitioning")
     if not partitioning_config:
         return ""
@@ -1,18 +1,33 @@
 # -*- coding: utf-8 -*-
 """Module with read/write utility functions using the Dataiku API"""
 
+import hashlib
 import logging
-import math
+import os
+import shutil
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from io import BytesIO
 from time import perf_counter
-from typing import Callable, Dict, AnyStr
+from typing import Callable, Dict, AnyStr, BinaryIO, Iterator, List, Tuple
 from tempfile import NamedTemporaryFile
 from pathlib import Path
 
 import numpy as np
-from tqdm import tqdm
+import pandas as pd
 
 import dataiku
 
+from chunk_scheduler import AdaptiveChunkScheduler
+from dku_api_cache import get_project, read_input_schema
+from data_loader import DataLoader
+from dimensionality_reduction import DimensionalityReduction
+from nearest_neighbor.base import NearestNeighborSearch
+from performance_tracking import PerformanceTracker, performance_tracker
+from utils import iter_array_blocks
+
 
 def count_records(dataset: dataiku.Dataset) -> int:
     """Count the number of records of a dataset using the Dataiku dataset metrics API
@@ -26,8 +41,7 @@ def count_records(dataset: dataiku.Dataset) -> int:
     """
     metric_id = "records:COUNT_RECORDS"
     partitions = dataset.read_partitions
-    client = dataiku.api_client()
-    project = client.get_project(dataset.project_key)
+    project = get_project(dataset.project_key)
     record_count = 0
     logging.info(f"Counting records of dataset: {dataset.name}...")
     if partitions is None or len(partitions) == 0:
@@ -47,7 +61,15 @@ def count_records(dataset: dataiku.Dataset) -> int:
 
 
 def process_dataset_chunks(
-    input_dataset: dataiku.Dataset, output_dataset: dataiku.Dataset, func: Callable, chunksize: float = 1000, **kwargs
+    input_dataset: dataiku.Dataset,
+    output_dataset: dataiku.Dataset,
+    func: Callable,
+    chunksize: float = 1000,
+    adaptive_chunking: bool = False,
+    memory_budget_mb: float = 1024,
+    group_column: AnyStr = None,
+    array_column_types: Dict = None,
+    **kwargs,
 ) -> None:
     """Read a dataset by chunks, process each dataframe chunk with a function and write back to another dataset.
 
@@ -60,39 +82,102 @@ def process_dataset_chunks(
         func: The function to apply to the `input_dataset` by chunks of pandas.DataFrame
             This function must take a pandas.DataFrame as first input argument,
             and output another pandas.DataFrame
-        chunksize: Number of rows of each chunk of pandas.DataFrame fed to `func`
+        chunksize: Number of rows of each chunk of pandas.DataFrame fed to `func`,
+            or initial number of rows if `adaptive_chunking` is True
+        adaptive_chunking: If True, grow or shrink the chunk size based on measured throughput and memory
+        memory_budget_mb: Maximum memory used to process a chunk, in megabytes, if `adaptive_chunking` is True
+        group_column: Optional column of contiguous group ids: rows of the same group are never split across chunks
+        array_column_types: Optional element types of output columns holding JSON arrays, by column name,
+            to type them as arrays in the output schema instead of strings
         **kwargs: Optional keyword arguments fed to `func`
 
     Raises:
         ValueError: If the input dataset is empty or if pandas cannot read it without type inference
 
     """
+    from tqdm import tqdm  # deferred import to speed up recipe startup
+
     input_count_records = count_records(input_dataset)
     if input_count_records == 0:
         raise ValueError("Input dataset has no records")
-    logging.info(f"Processing dataset {input_dataset.name} of {input_count_records} rows by chunks of {chunksize}...")
+    chunking = "adaptive chunks starting at" if adaptive_chunking else "chunks of"
+    logging.info(f"Processing dataset {input_dataset.name} of {input_count_records} rows by {chunking} {chunksize}...")
     start = perf_counter()
     # First, initialize output schema if not present. Required to show the real error if `iter_dataframes` fails.
     if not output_dataset.read_schema(raise_if_empty=False):
         df = input_dataset.get_dataframe(limit=5, infer_with_pandas=False)
         output_df = func(df=df, **kwargs)
-        output_dataset.write_schema_from_dataframe(output_df)
+        _write_schema_from_dataframe(output_dataset, output_df, array_column_types)
+    scheduler = None
+    if adaptive_chunking or group_column:
+        scheduler = AdaptiveChunkScheduler(int(chunksize), memory_budget_mb)
     with output_dataset.get_writer() as writer:
-        df_iterator = input_dataset.iter_dataframes(chunksize=chunksize, infer_with_pandas=False)
-        len_iterator = math.ceil(input_count_records / chunksize)
-        for i, df in tqdm(enumerate(df_iterator), total=len_iterator, unit="chunk", mininterval=1.0):
+        df_iterator = _track_dataset_read(input_dataset.iter_dataframes(chunksize=chunksize, infer_with_pandas=False))
+        if scheduler is not None:
+            df_iterator = scheduler.iter_chunks(df_iterator, group_column)
+        progress_bar = tqdm(total=input_count_records, unit="row", mininterval=1.0)
+        chunk_start = perf_counter()
+        phase_seconds = performance_tracker.get_phase_seconds()
+        allocated_bytes = performance_tracker.allocated_bytes
+        for i, df in enumerate(df_iterator):
             output_df = func(df=df, **kwargs)
-            if i == 0:
-                output_dataset.write_schema_from_dataframe(
-                    output_df, dropAndCreate=bool(not output_dataset.writePartition)
+            with performance_tracker.phase("dataset_write", num_items=len(output_df.index)):
+                if i == 0:
+                    _write_schema_from_dataframe(
+                        output_dataset,
+                        output_df,
+                        array_column_types,
+                        dropAndCreate=bool(not output_dataset.writePartition),
+                    )
+                writer.write_dataframe(output_df)
+            progress_bar.update(len(df.index))
+            if adaptive_chunking:
+                (previous_phase_seconds, phase_seconds) = (phase_seconds, performance_tracker.get_phase_seconds())
+                (previous_allocated_bytes, allocated_bytes) = (allocated_bytes, performance_tracker.allocated_bytes)
+                scheduler.update(
+                    num_rows=len(df.index),
+                    seconds=perf_counter() - chunk_start,
+                    memory_mb=scheduler.estimate_memory_mb(
+                        df, output_df, allocated_bytes=allocated_bytes - previous_allocated_bytes
+                    ),
+                    phase_seconds={k: v - previous_phase_seconds.get(k, 0.0) for k, v in phase_seconds.items()},
                 )
-            writer.write_dataframe(output_df)
+                chunk_start = perf_counter()
+        progress_bar.close()
+    if adaptive_chunking:
+        scheduler.log_summary()
     logging.info(
         f"Processing dataset {input_dataset.name} of {input_count_records} rows: "
         + f"Done in {perf_counter() - start:.2f} seconds."
     )
 
 
+def _write_schema_from_dataframe(
+    output_dataset: dataiku.Dataset, df: pd.DataFrame, array_column_types: Dict = None, dropAndCreate: bool = False
+) -> None:
+    """Write the schema inferred from a dataframe, typing columns of JSON arrays as arrays of the given types"""
+    output_dataset.write_schema_from_dataframe(df, dropAndCreate=dropAndCreate)
+    if array_column_types:
+        output_dataset_schema = output_dataset.read_schema()
+        for output_col_info in output_dataset_schema:
+            content_type = array_column_types.get(output_col_info.get("name", ""))
+            if content_type is not None:
+                output_col_info["type"] = "array"
+                output_col_info["arrayContent"] = {"name": "", "type": content_type}
+        output_dataset.write_schema(output_dataset_schema, dropAndCreate=dropAndCreate)
+
+
+def _track_dataset_read(df_iterator: Iterator[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    """Wrap a pandas.DataFrame iterator to record the time spent reading each chunk"""
+    while True:
+        start = perf_counter()
+        df = next(df_iterator, None)
+        if df is None:
+            break
+        performance_tracker.record("dataset_read", perf_counter() - start, len(df.index))
+        yield df
+
+
 def set_column_descriptions(
     output_dataset: dataiku.Dataset, column_descriptions: Dict, input_dataset: dataiku.Dataset = None
 ) -> None:
@@ -111,7 +196,7 @@ def set_column_descriptions(
     input_dataset_schema = []
     input_columns_names = []
     if input_dataset is not None:
-        input_dataset_schema = input_dataset.read_schema()
+        input_dataset_schema = read_input_schema(input_dataset)
         input_columns_names = [col["name"] for col in input_dataset_schema]
     for output_col_info in output_dataset_schema:
         output_col_name = output_col_info.get("name", "")
@@ -127,29 +212,283 @@ def set_column_descriptions(
     output_dataset.write_schema(output_dataset_schema)
 
 
-def save_array_to_folder(array: np.array, path: AnyStr, folder: dataiku.Folder, compress: bool = True) -> None:
-    """Save a numpy array to a Dataiku folder"""
-    with NamedTemporaryFile() as tmp:
-        if compress:
-            np.savez_compressed(tmp, array)
-        else:
-            np.savez(tmp, array)
-        _ = tmp.seek(0)  # Oh, take me back to the start
-        folder.upload_stream(path, tmp)
+def spill_dataset_to_memmap(
+    input_dataset: dataiku.Dataset,
+    columns: List[AnyStr],
+    data_loader: DataLoader,
+    scratch_path: AnyStr,
+    memory_budget_mb: float = 1024,
+) -> Tuple[np.array, np.memmap, int]:
+    """Read a dataset by chunks, parse each chunk into arrays and append them to a local float32 scratch file
+
+    The chunk size is derived from the memory budget, based on the memory footprint of a sample of rows,
+    so that the raw and parsed chunks and the temporary objects of a decoding batch stay within a quarter of the budget.
+
+    Args:
+        input_dataset: Input dataiku.Dataset instance
+        columns: Columns to read from the dataset
+        data_loader: DataLoader instance to parse each chunk into arrays
+        scratch_path: Path of the local file where parsed arrays are written
+        memory_budget_mb: Target peak memory in megabytes
+
+    Returns:
+        Tuple of array ids, memory-mapped arrays backed by the scratch file and the number of rows per chunk
+
+    Raises:
+        ValueError: If the input dataset is empty or if its unique ID column has duplicates across chunks
+
+    """
+    sample_df = input_dataset.get_dataframe(columns=columns, limit=100, infer_with_pandas=False)
+    if len(sample_df.index) == 0:
+        raise ValueError("Input dataset is empty")
+    (_, sample_arrays) = data_loader.convert_df_to_arrays(sample_df, verbose=False)
+    raw_bytes_per_row = sample_df.memory_usage(deep=True).sum() / len(sample_df.index)
+    chunk_bytes_per_row = raw_bytes_per_row + sample_arrays[0].nbytes
+    # Array columns are decoded by batches of rows, into the joined JSON text and lists of 32-byte Python floats
+    decode_bytes_per_row = raw_bytes_per_row + data_loader.DECODE_BYTES_PER_VALUE * sample_arrays.shape[1]
+    target_bytes = memory_budget_mb * 1024 ** 2 / 4
+    chunksize = int(target_bytes / (chunk_bytes_per_row + decode_bytes_per_row))  # chunk decoded in a single batch
+    if chunksize > data_loader.DECODE_BATCH_SIZE:
+        chunksize = int((target_bytes - data_loader.DECODE_BATCH_SIZE * decode_bytes_per_row) / chunk_bytes_per_row)
+    chunksize = max(100, chunksize)
+    logging.info(f"Spilling parsed arrays to local scratch file by chunks of {chunksize} rows...")
+    start = perf_counter()
+    array_ids = []
+    with open(scratch_path, "wb") as scratch_file:
+        df_iterator = input_dataset.iter_dataframes(chunksize=chunksize, columns=columns, infer_with_pandas=False)
+        for df in _track_dataset_read(df_iterator):
+            (chunk_array_ids, chunk_arrays) = data_loader.convert_df_to_arrays(df, verbose=False)
+            array_ids.append(chunk_array_ids.copy())  # a view would keep the whole raw chunk in memory
+            chunk_arrays.tofile(scratch_file)
+    array_ids = np.concatenate(array_ids)
+    if not pd.Series(array_ids).is_unique:
+        raise ValueError(f"Values in the unique ID column '{data_loader.unique_id_column}' should be unique")
+    arrays = np.memmap(scratch_path, dtype=np.float32, mode="r", shape=(len(array_ids), sample_arrays.shape[1]))
+    logging.info(
+        f"Spilling parsed arrays to local scratch file: dimensions {arrays.shape} "
+        + f"written in {perf_counter() - start:.2f} seconds."
+    )
+    return (array_ids, arrays, chunksize)
+
+
+def _save_memmap_to_npz(array: np.memmap, file: BinaryIO, compress: bool = True) -> None:
+    """Write a memory-mapped array in the same .npz format as numpy.savez without loading it fully in memory"""
+    compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    with zipfile.ZipFile(file, mode="w", compression=compression, allowZip64=True) as zip_file:
+        with zip_file.open("arr_0.npy", mode="w", force_zip64=True) as npy_file:
+            np.lib.format.write_array_header_2_0(npy_file, np.lib.format.header_data_from_array_1_0(array))
+            for block in iter_array_blocks(array, NearestNeighborSearch.BUILD_BLOCK_SIZE):
+                npy_file.write(block.tobytes())
+
+
+class _ChecksumReader:
+    """Wrap a binary stream to compute the size and SHA-256 checksum of the bytes read from it"""
+
+    CHUNK_SIZE = 2 ** 20
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.size = 0
+        self.hash = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        self.size += len(data)
+        self.hash.update(data)
+        return data
+
+    def __iter__(self):  # allows chunked streaming uploads of unknown length
+        return iter(lambda: self.read(self.CHUNK_SIZE), b"")
+
+    def get_file_info(self) -> Dict:
+        return {"size": self.size, "sha256": self.hash.hexdigest()}
+
+
+class ArtifactWriter:
+    """Write index artifacts to a Dataiku folder concurrently, and a manifest of their sizes and checksums
+
+    Arrays are serialized in .npz format straight into the upload stream through a pipe, without temporary copy.
+    Use as a context manager: exiting waits for all uploads, raises the first error if any, then writes the manifest.
+    On error in the with block, pending uploads are cancelled and no manifest is written.
+    The upload threads are shut down on every path.
+    """
+
+    MANIFEST_FILE_NAME = "manifest.json"
+
+    def __init__(self, folder: dataiku.Folder, folder_partition_root: AnyStr = "", max_workers: int = 4):
+        self.folder = folder
+        self.folder_partition_root = folder_partition_root
+        self._exit_stack = ExitStack()
+        self.executor = self._exit_stack.enter_context(ThreadPoolExecutor(max_workers=max_workers))
+        self.futures = {}
 
+    def __enter__(self):
+        return self
 
-def download_file_from_folder_to_tmp(path: AnyStr, folder: dataiku.Folder) -> NamedTemporaryFile:
-    """Download a file from a Dataiku Folder into a local temporary file"""
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self._exit_stack:
+            if exc_type is None:
+                self.close()
+            else:  # no manifest for an incomplete index folder
+                for future in self.futures.values():
+                    future.cancel()
+
+    def _upload(self, file_name: AnyStr, stream: BinaryIO) -> Dict:
+        reader = _ChecksumReader(stream)
+        with performance_tracker.phase("upload"):
+            self.folder.upload_stream(os.path.join(self.folder_partition_root, file_name), reader)
+        logging.info(f"Uploaded {file_name} ({reader.size} bytes)")
+        return reader.get_file_info()
+
+    def _upload_local_file(self, file_name: AnyStr, local_path: AnyStr) -> Dict:
+        with open(local_path, "rb") as stream:
+            return self._upload(file_name, stream)
+
+    def _upload_array(self, file_name: AnyStr, array: np.array, compress: bool) -> Dict:
+        (read_fd, write_fd) = os.pipe()
+        serialization_errors = []
+
+        def serialize():
+            try:
+                with os.fdopen(write_fd, "wb") as pipe_writer:
+                    with performance_tracker.phase("array_serialization", num_items=len(array)):
+                        if isinstance(array, np.memmap):
+                            _save_memmap_to_npz(array, pipe_writer, compress)
+                        elif compress:
+                            np.savez_compressed(pipe_writer, array)
+                        else:
+                            np.savez(pipe_writer, array)
+            except Exception as e:  # includes BrokenPipeError if the upload failed first
+                serialization_errors.append(e)
+
+        serializer = threading.Thread(target=serialize, name=f"serialize-{file_name}", daemon=True)
+        serializer.start()
+        try:
+            with os.fdopen(read_fd, "rb") as pipe_reader:
+                file_info = self._upload(file_name, pipe_reader)
+        finally:
+            serializer.join()
+        if serialization_errors:
+            raise serialization_errors[0]
+        return file_info
+
+    def upload_file(self, local_path: AnyStr, file_name: AnyStr) -> None:
+        """Upload a local file - it must not be deleted before the writer is closed"""
+        self.futures[file_name] = self.executor.submit(self._upload_local_file, file_name, local_path)
+
+    def upload_bytes(self, data: bytes, file_name: AnyStr) -> None:
+        self.futures[file_name] = self.executor.submit(self._upload, file_name, BytesIO(data))
+
+    def save_array(self, array: np.array, file_name: AnyStr, compress: bool = True) -> None:
+        """Serialize a numpy array (possibly memory-mapped) to .npz format while uploading it"""
+        self.futures[file_name] = self.executor.submit(self._upload_array, file_name, array, compress)
+
+    def close(self) -> Dict:
+        """Wait for all uploads to finish and write the manifest of uploaded files
+
+        Raises:
+            Exception: The first error raised by an upload, in which case no manifest is written
+
+        """
+        with self._exit_stack:
+            manifest = {"files": {file_name: future.result() for file_name, future in self.futures.items()}}
+        self.folder.write_json(os.path.join(self.folder_partition_root, self.MANIFEST_FILE_NAME), manifest)
+        return manifest
+
+
+def read_manifest(folder: dataiku.Folder, folder_partition_root: AnyStr = "") -> Dict:
+    """Read the manifest of files of an index folder - empty for index folders built before manifests existed
+
+    Raises:
+        Exception: If the manifest exists but cannot be read
+
+    """
+    manifest_file_path = os.path.join(folder_partition_root, ArtifactWriter.MANIFEST_FILE_NAME)
+    try:
+        return folder.read_json(manifest_file_path).get("files", {})
+    except Exception:
+        if folder.get_path_details(manifest_file_path).get("exists"):
+            raise
+    logging.info("No manifest in index folder: skipping checksum verification")
+    return {}
+
+
+def download_file_from_folder_to_tmp(
+    path: AnyStr, folder: dataiku.Folder, expected_file_info: Dict = None
+) -> NamedTemporaryFile:
+    """Download a file from a Dataiku Folder into a local temporary file, by chunks
+
+    Raises:
+        ValueError: If the size or checksum of the file differ from the expected ones, usually read from the manifest
+
+    """
     file_extension = Path(path).suffix
     tmp = NamedTemporaryFile(suffix=file_extension)
-    with folder.get_download_stream(path) as stream:
-        tmp.write(bytes(stream.read()))
+    with performance_tracker.phase("download"), folder.get_download_stream(path) as stream:
+        reader = _ChecksumReader(stream)
+        shutil.copyfileobj(reader, tmp, length=reader.CHUNK_SIZE)
+    if expected_file_info and reader.get_file_info() != expected_file_info:
+        tmp.close()
+        raise ValueError(f"File '{path}' is corrupted: {reader.get_file_info()} instead of {expected_file_info}")
     _ = tmp.seek(0)  # Come together, right now
     return tmp
 
 
-def load_array_from_folder(path: AnyStr, folder: dataiku.Folder) -> np.array:
-    """Load a numpy array from a Dataiku folder using a local temporary file"""
-    with download_file_from_folder_to_tmp(path, folder) as tmp:
-        array = np.load(tmp.name, allow_pickle=True)["arr_0"]
-    return array
+def load_index_from_folder(
+    folder: dataiku.Folder, folder_partition_root: AnyStr = ""
+) -> Tuple[NearestNeighborSearch, np.array]:
+    """Load a pre-computed index and its array ids from a Dataiku folder written by the indexing recipe
+
+    Index files are downloaded in parallel, and verified against the folder manifest if present.
+    """
+    config_file_path = os.path.join(folder_partition_root, NearestNeighborSearch.CONFIG_FILE_NAME)
+    index_config = folder.read_json(config_file_path)
+    manifest = read_manifest(folder, folder_partition_root)
+    nearest_neighbor = NearestNeighborSearch(**index_config)
+    file_names = [nearest_neighbor.INDEX_FILE_NAME, nearest_neighbor.ARRAY_IDS_FILE_NAME]
+    if index_config.get("dimensionality_reduction"):
+        file_names.append(index_config["dimensionality_reduction"]["file_name"])
+    with ThreadPoolExecutor(max_workers=len(file_names)) as executor:
+        futures = {
+            file_name: executor.submit(
+                download_file_from_folder_to_tmp,
+                os.path.join(folder_partition_root, file_name),
+                folder,
+                manifest.get(file_name),
+            )
+            for file_name in file_names
+        }
+        downloaded_files = {file_name: future.result() for file_name, future in futures.items()}
+    with downloaded_files[nearest_neighbor.INDEX_FILE_NAME] as tmp:
+        nearest_neighbor.load_index(tmp.name)
+    with downloaded_files[nearest_neighbor.ARRAY_IDS_FILE_NAME] as tmp:
+        index_array_ids = np.load(tmp.name, allow_pickle=True)["arr_0"]
+    if index_config.get("dimensionality_reduction"):
+        with downloaded_files[index_config["dimensionality_reduction"]["file_name"]] as tmp:
+            nearest_neighbor.dimensionality_reduction = DimensionalityReduction.load(tmp.name)
+    return (nearest_neighbor, index_array_ids)
+
+
+def save_performance_report(
+    tracker: PerformanceTracker, folder: dataiku.Folder, folder_partition_root: AnyStr = ""
+) -> Dict:
+    """Log the performance report of a recipe run and write it as JSON to a Dataiku folder
+
+    If profiling was started on the tracker, the cProfile statistics are also uploaded next to the report.
+
+    Args:
+        tracker: PerformanceTracker instance which recorded the recipe run
+        folder: Output dataiku.Folder instance
+        folder_partition_root: Partition root path of the folder, empty if not partitioned
+
+    Returns:
+        Performance report as a dictionary
+
+    """
+    if tracker.profiler is not None:
+        with NamedTemporaryFile(suffix=".prof") as tmp:
+            tracker.stop_profiling(tmp.name)
+            folder.upload_stream(os.path.join(folder_partition_root, tracker.PROFILE_FILE_NAME), tmp)
+    report = tracker.log_report()
+    folder.write_json(os.path.join(folder_partition_root, tracker.REPORT_FILE_NAME), report)
+    return report
@@ -8,7 +8,9 @@ from enum import Enum
 import dataiku
 from dataiku.customrecipe import get_recipe_config, get_input_names_for_role, get_output_names_for_role
 
+from dku_api_cache import read_input_schema
 from dku_folder_partition_handling import get_folder_partition_root, check_only_one_read_partition
+from nearest_neighbor.output_format import NEIGHBOR_ID_TYPES, OUTPUT_FORMATS
 
 
 class RecipeID(Enum):
@@ -46,27 +48,47 @@ def load_input_output_params(recipe_id: RecipeID) -> Dict:
         input_folder_names = get_input_names_for_role("index_folder")
         if len(input_folder_names) == 0:
             raise PluginParamValidationError("Please specify index folder as input")
-        params["index_folder"] = dataiku.Folder(input_folder_names[0])
-        params["folder_partition_root"] = get_folder_partition_root(params["index_folder"], is_input=True)
-        check_only_one_read_partition(params["folder_partition_root"], params["index_folder"])
+        # Several index folders may be searched in one pass over the input dataset
+        params["index_folders"] = [dataiku.Folder(name) for name in input_folder_names]
+        index_folder_names = [index_folder.get_name() for index_folder in params["index_folders"]]
+        duplicate_names = sorted({name for name in index_folder_names if index_folder_names.count(name) > 1})
+        if duplicate_names:
+            raise PluginParamValidationError(f"Index folders must have distinct names, found: {duplicate_names}")
+        params["folder_partition_roots"] = []
+        for index_folder in params["index_folders"]:
+            folder_partition_root = get_folder_partition_root(index_folder, is_input=True)
+            check_only_one_read_partition(folder_partition_root, index_folder)
+            params["folder_partition_roots"].append(folder_partition_root)
+        params["index_folder"] = params["index_folders"][0]
+        params["folder_partition_root"] = params["folder_partition_roots"][0]
     # Input dataset
     input_dataset_names = get_input_names_for_role("input_dataset")
     if len(input_dataset_names) == 0:
         raise PluginParamValidationError("Please specify input dataset")
     params["input_dataset"] = dataiku.Dataset(input_dataset_names[0])
-    input_dataset_columns = [p["name"] for p in params["input_dataset"].read_schema()]
+    params["input_schema"] = read_input_schema(params["input_dataset"])
+    input_dataset_columns = [p["name"] for p in params["input_schema"]]
     check_only_one_read_partition(params["folder_partition_root"], params["input_dataset"])
     if recipe_id == RecipeID.SIMILARITY_SEARCH_QUERY:
-        if params["index_folder"].read_partitions != params["input_dataset"].read_partitions:
-            raise PluginParamValidationError(
-                "Inconsistent partitions between index folder and input dataset, please make sure both are partitioned with the same dimensions"
-            )
+        for index_folder in params["index_folders"]:
+            if index_folder.read_partitions != params["input_dataset"].read_partitions:
+                raise PluginParamValidationError(
+                    "Inconsistent partitions between index folder and input dataset, "
+                    + "please make sure both are partitioned with the same dimensions"
+                )
     # Output dataset - only for search recipe
     if recipe_id == RecipeID.SIMILARITY_SEARCH_QUERY:
         output_dataset_names = get_output_names_for_role("output_dataset")
         if len(output_dataset_names) == 0:
             raise PluginParamValidationError("Please specify output dataset")
         params["output_dataset"] = dataiku.Dataset(output_dataset_names[0])
+        # Optional folder to save performance reports - the index folder is read-only in this recipe
+        report_folder_names = get_output_names_for_role("report_folder")
+        params["report_folder"] = None
+        params["report_folder_partition_root"] = ""
+        if len(report_folder_names) != 0:
+            params["report_folder"] = dataiku.Folder(report_folder_names[0])
+            params["report_folder_partition_root"] = get_folder_partition_root(params["report_folder"])
     # Recipe input parameters
     recipe_config = get_recipe_config()
     params["unique_id_column"] = recipe_config.get("unique_id_column")
@@ -75,7 +97,19 @@ def load_input_output_params(recipe_id: RecipeID) -> Dict:
     params["feature_columns"] = recipe_config.get("feature_columns", [])
     if not set(params["feature_columns"]).issubset(set(input_dataset_columns)):
         raise PluginParamValidationError(f"Invalid feature column(s): {params['feature_columns']}")
-    printable_params = {k: v for k, v in params.items() if k not in {"input_dataset", "index_folder", "output_dataset"}}
+    params["performance_report"] = bool(recipe_config.get("performance_report"))
+    if recipe_id == RecipeID.SIMILARITY_SEARCH_INDEX:  # performance parameters are expert ones in this recipe
+        params["performance_report"] = params["performance_report"] and bool(recipe_config.get("expert"))
+    params["profiling"] = bool(recipe_config.get("profiling")) and params["performance_report"]
+    non_printable_params = {
+        "input_dataset",
+        "input_schema",
+        "index_folder",
+        "index_folders",
+        "output_dataset",
+        "report_folder",
+    }
+    printable_params = {k: v for k, v in params.items() if k not in non_printable_params}
     logging.info(f"Validated input/output parameters: {printable_params}")
     return params
 
@@ -117,6 +151,36 @@ def load_indexing_recipe_params() -> Dict:
             raise PluginParamValidationError(f"Invalid number of LSH bits: {modeling_params['faiss_lsh_num_bits']}")
         if modeling_params["faiss_lsh_num_bits"] < 4:
             raise PluginParamValidationError("Number of LSH bits must be above 4")
+    modeling_params["dimensionality_reduction"] = "none"
+    if modeling_params["expert"]:
+        modeling_params["dimensionality_reduction"] = recipe_config.get("dimensionality_reduction", "none")
+    if modeling_params["dimensionality_reduction"] not in {"none", "pca", "random_projection"}:
+        raise PluginParamValidationError(
+            f"Invalid dimensionality reduction: {modeling_params['dimensionality_reduction']}"
+        )
+    if modeling_params["dimensionality_reduction"] == "pca":
+        modeling_params["target_explained_variance"] = recipe_config.get("target_explained_variance", 0.95)
+        if not isinstance(modeling_params["target_explained_variance"], (int, float)):
+            raise PluginParamValidationError(
+                f"Invalid target explained variance: {modeling_params['target_explained_variance']}"
+            )
+        if not 0 < modeling_params["target_explained_variance"] <= 1:
+            raise PluginParamValidationError("Target explained variance must be between 0 and 1")
+    elif modeling_params["dimensionality_reduction"] == "random_projection":
+        modeling_params["reduction_num_dimensions"] = recipe_config.get("reduction_num_dimensions")
+        if not isinstance(modeling_params["reduction_num_dimensions"], int):
+            raise PluginParamValidationError(
+                f"Invalid number of dimensions: {modeling_params['reduction_num_dimensions']}"
+            )
+        if modeling_params["reduction_num_dimensions"] < 1:
+            raise PluginParamValidationError("Number of dimensions must be above 1")
+    modeling_params["out_of_core"] = bool(recipe_config.get("out_of_core")) and modeling_params["expert"]
+    if modeling_params["out_of_core"]:
+        modeling_params["memory_budget_mb"] = recipe_config.get("memory_budget_mb", 1024)
+        if not isinstance(modeling_params["memory_budget_mb"], int):
+            raise PluginParamValidationError(f"Invalid memory budget: {modeling_params['memory_budget_mb']}")
+        if modeling_params["memory_budget_mb"] < 64:
+            raise PluginParamValidationError("Memory budget must be above 64 MB")
     logging.info(f"Validated modeling parameters: {modeling_params}")
     return {**input_output_params, **modeling_params}
 
@@ -141,5 +205,32 @@ def load_search_recipe_params() -> Dict:
         raise PluginParamValidationError(f"Invalid number of neighbors: {lookup_params['num_neighbors']}")
     if lookup_params["num_neighbors"] < 1 or lookup_params["num_neighbors"] > 1000:
         raise PluginParamValidationError("Number of neighbors must be between 1 and 1000")
+    lookup_params["multi_index_output"] = "separate"
+    if len(input_output_params["index_folders"]) > 1:  # ignored with a single index folder
+        lookup_params["multi_index_output"] = recipe_config.get("multi_index_output", "separate")
+    if lookup_params["multi_index_output"] not in {"separate", "merged"}:
+        raise PluginParamValidationError(f"Invalid multi-index output: {lookup_params['multi_index_output']}")
+    lookup_params["output_format"] = recipe_config.get("output_format", "long")
+    if lookup_params["output_format"] not in OUTPUT_FORMATS:
+        raise PluginParamValidationError(f"Invalid output format: {lookup_params['output_format']}")
+    lookup_params["neighbor_id_type"] = recipe_config.get("neighbor_id_type", "id")
+    if lookup_params["neighbor_id_type"] not in NEIGHBOR_ID_TYPES:
+        raise PluginParamValidationError(f"Invalid neighbor ID type: {lookup_params['neighbor_id_type']}")
+    lookup_params["group_column"] = recipe_config.get("group_column") or None
+    if lookup_params["group_column"] is not None:
+        if lookup_params["group_column"] not in [column["name"] for column in input_output_params["input_schema"]]:
+            raise PluginParamValidationError(f"Invalid group column: {lookup_params['group_column']}")
+        if len(input_output_params["index_folders"]) > 1:
+            raise PluginParamValidationError("Grouping query vectors is only available with a single index folder")
+        lookup_params["group_aggregation"] = recipe_config.get("group_aggregation", "min_distance")
+        if lookup_params["group_aggregation"] not in {"min_distance", "mean_distance", "rrf"}:
+            raise PluginParamValidationError(f"Invalid group aggregation: {lookup_params['group_aggregation']}")
+    lookup_params["adaptive_chunking"] = bool(recipe_config.get("adaptive_chunking", False))
+    if lookup_params["adaptive_chunking"]:
+        lookup_params["memory_budget_mb"] = recipe_config.get("memory_budget_mb", 1024)
+        if not isinstance(lookup_params["memory_budget_mb"], int):
+            raise PluginParamValidationError(f"Invalid memory budget: {lookup_params['memory_budget_mb']}")
+        if lookup_params["memory_budget_mb"] < 64:
+            raise PluginParamValidationError("Memory budget must be above 64 MB")
     logging.info(f"Validated lookup parameters: {lookup_params}")
     return {**input_output_params, **lookup_params}
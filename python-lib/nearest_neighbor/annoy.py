@@ -7,10 +7,10 @@ import numpy as np
 from typing import AnyStr, Dict, List, Tuple
 
 import annoy
-from tqdm import tqdm
 
 from nearest_neighbor.base import NearestNeighborSearch
-from utils import time_logging
+from utils import time_logging, iter_array_blocks
+from performance_tracking import performance_tracker
 
 
 class Annoy(NearestNeighborSearch):
@@ -34,20 +34,32 @@ class Annoy(NearestNeighborSearch):
         }
 
     @time_logging(log_message="Building index and saving to disk")
-    def build_save_index(self, arrays: np.array, index_path: AnyStr) -> None:
-        self.index.on_disk_build(index_path)
-        for i, array in enumerate(tqdm(arrays, mininterval=1.0)):
-            self.index.add_item(i, array.tolist())
-        self.index.build(n_trees=self.annoy_num_trees)
+    def build_save_index(
+        self, arrays: np.array, index_path: AnyStr, block_size: int = NearestNeighborSearch.BUILD_BLOCK_SIZE
+    ) -> None:
+        from tqdm import tqdm  # deferred import to speed up recipe startup
+
+        with performance_tracker.phase("index_build", num_items=len(arrays)):
+            self.index.on_disk_build(index_path)
+            with tqdm(total=len(arrays), mininterval=1.0) as progress_bar:
+                i = 0
+                for block in iter_array_blocks(arrays, block_size):
+                    for array in block:
+                        self.index.add_item(i, array.tolist())
+                        i += 1
+                    progress_bar.update(len(block))
+            self.index.build(n_trees=self.annoy_num_trees)
         logging.info(f"Index file path: {index_path}")
 
     @time_logging(log_message="Loading pre-computed index")
     def load_index(self, file_path: AnyStr) -> None:
-        self.index.load(file_path)
+        with performance_tracker.phase("index_load"):
+            self.index.load(file_path)
 
     def find_neighbors_array(self, arrays: np.array, num_neighbors: int = 5) -> List[List[Tuple]]:
         output = []
-        for array in arrays:
-            (neighbors, distances) = self.index.get_nns_by_vector(array, num_neighbors, include_distances=True)
-            output.append(list(zip(neighbors, distances)))
+        with performance_tracker.phase("search", num_items=len(arrays)):
+            for array in arrays:
+                (neighbors, distances) = self.index.get_nns_by_vector(array, num_neighbors, include_distances=True)
+                output.append(list(zip(neighbors, distances)))
         return output
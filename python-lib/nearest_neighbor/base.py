@@ -7,6 +7,15 @@ import numpy as np
 import pandas as pd
 
 from data_loader import DataLoader
+from nearest_neighbor.output_format import (
+    NEIGHBOR_ID_TYPES,
+    build_output_df,
+    encode_json_values,
+    get_array_column_types,
+    get_array_content_type,
+    get_column_descriptions,
+)
+from performance_tracking import performance_tracker
 
 
 class NearestNeighborSearch:
@@ -19,11 +28,15 @@ class NearestNeighborSearch:
     INPUT_COLUMN_NAME = "input_id"
     NEIGHBOR_COLUMN_NAME = "neighbor_id"
     DISTANCE_COLUMN_NAME = "distance"
+    NEIGHBOR_POSITION_COLUMN_NAME = "neighbor_position"
+    BUILD_BLOCK_SIZE = 2 ** 16  # number of rows added to the index at once
+    NEIGHBOR_PAIR_BYTES = 120  # (index, distance) tuple in the Python lists of `find_neighbors_array`
     COLUMN_DESCRIPTIONS = {
         INPUT_COLUMN_NAME: "Unique ID from the input dataset",
         NEIGHBOR_COLUMN_NAME: "Neighbor ID from the pre-computed index",
         DISTANCE_COLUMN_NAME: "Distance with neighbor",
     }
+    NEIGHBOR_POSITION_DESCRIPTION = "Position of the neighbor in the pre-computed index, starting from 0"
 
     def __new__(cls, *args, **kwargs):
         """Determine the appropriate algorithm based on the arguments"""
@@ -45,13 +58,37 @@ class NearestNeighborSearch:
 
     def __init__(self, num_dimensions: int, **kwargs):
         self.num_dimensions = num_dimensions
+        self.dimensionality_reduction = None  # optional DimensionalityReduction applied to arrays before search
+        self._data_loader = None
+        self._encoded_array_ids = None  # (index array ids, JSON tokens) cached for the wide output format
+
+    @property
+    def input_num_dimensions(self) -> int:
+        """Number of dimensions of the arrays before dimensionality reduction, if any"""
+        if self.dimensionality_reduction is not None:
+            return self.dimensionality_reduction.input_dimensions
+        return self.num_dimensions
+
+    def transform_arrays(self, arrays: np.array) -> np.array:
+        """Check the number of dimensions of raw arrays and apply the dimensionality reduction used at indexing"""
+        if arrays.shape[1] != self.input_num_dimensions:
+            raise ValueError(
+                "Incompatible number of dimensions: "
+                + f"{self.input_num_dimensions} in index, {arrays.shape[1]} in feature column(s)"
+            )
+        if self.dimensionality_reduction is not None:
+            arrays = self.dimensionality_reduction.transform(arrays)
+        return arrays
 
     def get_config(self) -> Dict:
         """Config required to reload the index after initial build"""
         raise NotImplementedError("Get config method not implemented")
 
-    def build_save_index(self, arrays: np.array, index_path: AnyStr) -> None:
-        """Add arrays (a.k.a. vectors) to the index and save to disk"""
+    def build_save_index(self, arrays: np.array, index_path: AnyStr, block_size: int = BUILD_BLOCK_SIZE) -> None:
+        """Add arrays (a.k.a. vectors) to the index by blocks of rows and save to disk
+
+        Arrays may be a numpy.memmap of a local scratch file, in which case only one block is loaded at a time.
+        """
         raise NotImplementedError("Index building and saving method not implemented")
 
     def load_index(self, index_file_path: AnyStr) -> None:
@@ -62,6 +99,78 @@ class NearestNeighborSearch:
         """Find nearest neighbors of each arrays (a.k.a. vectors) and return pairs of (index, distance)"""
         raise NotImplementedError("Find neighbors method not implemented")
 
+    def search_arrays(self, arrays: np.array, num_neighbors: int = 5) -> Tuple[np.array, np.array]:
+        """Find nearest neighbors of each arrays (a.k.a. vectors) and return matrices of indices and distances
+
+        Rows with less than `num_neighbors` neighbors are padded with index -1 and distance +inf.
+        """
+        neighbors = np.full((len(arrays), num_neighbors), -1, dtype=np.int64)
+        distances = np.full((len(arrays), num_neighbors), np.inf, dtype=np.float32)
+        performance_tracker.record_allocation(
+            neighbors.nbytes + distances.nbytes + neighbors.size * self.NEIGHBOR_PAIR_BYTES
+        )
+        for i, index_distance_pairs in enumerate(self.find_neighbors_array(arrays, num_neighbors)):
+            for j, (index, distance) in enumerate(index_distance_pairs):
+                neighbors[i, j] = index
+                distances[i, j] = distance
+        return (neighbors, distances)
+
+    def get_data_loader(
+        self, unique_id_column: AnyStr, feature_columns: List[AnyStr], input_schema: List[Dict] = None
+    ) -> DataLoader:
+        """Create a DataLoader on the first chunk and reuse it for the next ones, to detect column kinds only once"""
+        if (
+            self._data_loader is None
+            or self._data_loader.unique_id_column != unique_id_column
+            or self._data_loader.feature_columns != feature_columns
+        ):
+            self._data_loader = DataLoader(unique_id_column, feature_columns, input_schema)
+        return self._data_loader
+
+    @classmethod
+    def get_column_descriptions(cls, output_format: AnyStr = "long", neighbor_id_type: AnyStr = "id") -> Dict:
+        """Descriptions of the output columns of `find_neighbors_df` for a given output format"""
+        column_descriptions = dict(cls.COLUMN_DESCRIPTIONS)
+        if neighbor_id_type == "position":
+            del column_descriptions[cls.NEIGHBOR_COLUMN_NAME]
+            column_descriptions[cls.NEIGHBOR_POSITION_COLUMN_NAME] = cls.NEIGHBOR_POSITION_DESCRIPTION
+        per_neighbor_columns = {cls.NEIGHBOR_COLUMN_NAME, cls.NEIGHBOR_POSITION_COLUMN_NAME, cls.DISTANCE_COLUMN_NAME}
+        return get_column_descriptions(column_descriptions, per_neighbor_columns, output_format)
+
+    @classmethod
+    def get_array_column_types(
+        cls, index_array_ids: np.array, output_format: AnyStr = "long", neighbor_id_type: AnyStr = "id"
+    ) -> Dict:
+        """Element types of the output columns of `find_neighbors_df` which are JSON arrays in the output format"""
+        if neighbor_id_type == "position":
+            array_content_types = {cls.NEIGHBOR_POSITION_COLUMN_NAME: "bigint"}
+        else:
+            array_content_types = {cls.NEIGHBOR_COLUMN_NAME: get_array_content_type(index_array_ids)}
+        array_content_types[cls.DISTANCE_COLUMN_NAME] = "double"
+        return get_array_column_types(array_content_types, output_format)
+
+    def get_neighbor_columns(
+        self,
+        neighbors: np.array,
+        index_array_ids: np.array,
+        output_format: AnyStr = "long",
+        neighbor_id_type: AnyStr = "id",
+    ) -> Dict[AnyStr, np.array]:
+        """Per-neighbor column of original array ids or index positions, matching a matrix of neighbor positions
+
+        For the wide output format, array ids are encoded as JSON tokens once and reused across chunks.
+        """
+        if neighbor_id_type not in NEIGHBOR_ID_TYPES:
+            raise ValueError(f"Invalid neighbor ID type: '{neighbor_id_type}'")
+        if neighbor_id_type == "position":
+            return {self.NEIGHBOR_POSITION_COLUMN_NAME: neighbors}
+        positions = np.maximum(neighbors, 0)  # padding is masked when building the output
+        if output_format == "wide":
+            if self._encoded_array_ids is None or self._encoded_array_ids[0] is not index_array_ids:
+                self._encoded_array_ids = (index_array_ids, encode_json_values(index_array_ids))
+            return {self.NEIGHBOR_COLUMN_NAME: self._encoded_array_ids[1][positions]}
+        return {self.NEIGHBOR_COLUMN_NAME: index_array_ids[positions]}
+
     def find_neighbors_df(
         self,
         df: pd.DataFrame,
@@ -69,24 +178,24 @@ class NearestNeighborSearch:
         feature_columns: List[AnyStr],
         index_array_ids: np.array,
         num_neighbors: int = 5,
+        input_schema: List[Dict] = None,
+        output_format: AnyStr = "long",
+        neighbor_id_type: AnyStr = "id",
         **kwargs,
     ) -> pd.DataFrame:
-        """Find nearest neighbors in a raw pandas DataFrame and format results into a new DataFrame"""
-        output_df = pd.DataFrame()
-        output_df[self.INPUT_COLUMN_NAME] = df[unique_id_column]
-        data_loader = DataLoader(unique_id_column, feature_columns)
+        """Find nearest neighbors in a raw pandas DataFrame and format results into a new DataFrame
+
+        The long output format has one row per pair of input and neighbor,
+        the wide output format has one row per input with arrays of neighbors and distances.
+        """
+        data_loader = self.get_data_loader(unique_id_column, feature_columns, input_schema)
         (array_ids, arrays) = data_loader.convert_df_to_arrays(df, verbose=False)
-        if arrays.shape[1] != self.num_dimensions:
-            raise ValueError(
-                "Incompatible number of dimensions: "
-                + f"{self.num_dimensions} in index, {arrays.shape[1]} in feature column(s)"
-            )
-        output_df["index_distance_pairs"] = self.find_neighbors_array(arrays, num_neighbors)
-        output_df = output_df.explode("index_distance_pairs")
-        output_df[self.NEIGHBOR_COLUMN_NAME] = output_df["index_distance_pairs"].apply(lambda x: int(x[0]))
-        output_df[self.DISTANCE_COLUMN_NAME] = output_df["index_distance_pairs"].apply(lambda x: float(x[1]))
-        output_df[self.NEIGHBOR_COLUMN_NAME] = (
-            output_df[self.NEIGHBOR_COLUMN_NAME].astype(int).apply(lambda i: index_array_ids[i])
-        )  # lookup the original array ids
-        del output_df["index_distance_pairs"]
+        (neighbors, distances) = self.search_arrays(self.transform_arrays(arrays), num_neighbors)
+        with performance_tracker.phase("dataframe_assembly", num_items=len(df.index)):
+            columns = {
+                self.INPUT_COLUMN_NAME: array_ids,
+                **self.get_neighbor_columns(neighbors, index_array_ids, output_format, neighbor_id_type),
+                self.DISTANCE_COLUMN_NAME: distances,
+            }
+            output_df = build_output_df(columns, found=neighbors >= 0, output_format=output_format)
         return output_df
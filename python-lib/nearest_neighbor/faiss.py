@@ -9,7 +9,8 @@ from typing import AnyStr, Dict, List, Tuple
 import faiss
 
 from nearest_neighbor.base import NearestNeighborSearch
-from utils import time_logging
+from utils import time_logging, iter_array_blocks
+from performance_tracking import performance_tracker
 
 
 class Faiss(NearestNeighborSearch):
@@ -38,19 +39,31 @@ class Faiss(NearestNeighborSearch):
         }
 
     @time_logging(log_message="Building index and saving to disk")
-    def build_save_index(self, arrays: np.array, index_path: AnyStr) -> None:
-        if self.index.is_trained:
-            self.index.add(arrays)
-        else:
-            raise NotImplementedError("Faiss training methods not implemented")
-        faiss.write_index(self.index, index_path)
+    def build_save_index(
+        self, arrays: np.array, index_path: AnyStr, block_size: int = NearestNeighborSearch.BUILD_BLOCK_SIZE
+    ) -> None:
+        with performance_tracker.phase("index_build", num_items=len(arrays)):
+            if not self.index.is_trained:
+                raise NotImplementedError("Faiss training methods not implemented")
+            for block in iter_array_blocks(arrays, block_size):
+                self.index.add(block)
+            faiss.write_index(self.index, index_path)
         logging.info(f"Index file path: {index_path}")
 
     @time_logging(log_message="Loading pre-computed index")
     def load_index(self, file_path: AnyStr) -> None:
-        self.index = faiss.read_index(file_path)
+        with performance_tracker.phase("index_load"):
+            self.index = faiss.read_index(file_path)
+
+    def search_arrays(self, arrays: np.array, num_neighbors: int = 5) -> Tuple[np.array, np.array]:
+        with performance_tracker.phase("search", num_items=len(arrays)):
+            (distances, neighbors) = self.index.search(arrays, num_neighbors)
+        distances[neighbors < 0] = np.inf
+        performance_tracker.record_allocation(neighbors.nbytes + distances.nbytes)
+        return (neighbors.astype(np.int64, copy=False), distances.astype(np.float32, copy=False))
 
     def find_neighbors_array(self, arrays: np.array, num_neighbors: int = 5) -> List[List[Tuple]]:
-        (distances, neighbors) = self.index.search(arrays, num_neighbors)
+        with performance_tracker.phase("search", num_items=len(arrays)):
+            (distances, neighbors) = self.index.search(arrays, num_neighbors)
         output = [list(zip(neighbor, distances[i])) for i, neighbor in enumerate(neighbors)]
         return output
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""Module to aggregate nearest neighbors over groups of query arrays, e.g. all images of a product"""
+
+from typing import AnyStr, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from data_loader import DataLoader
+from nearest_neighbor.base import NearestNeighborSearch
+from nearest_neighbor.output_format import build_output_df, get_array_column_types, get_column_descriptions
+from performance_tracking import performance_tracker
+
+
+class GroupNearestNeighborSearch:
+    """Find the nearest neighbors of groups of arrays (a.k.a. vectors) sharing the same group id
+
+    All arrays of a chunk are searched in one batch, then the neighbors of each array are aggregated
+    into a per-group top-k in vectorized form:
+    - min_distance: smallest distance between the neighbor and the arrays of the group
+    - mean_distance: mean distance between the neighbor and the arrays of the group which have it in their top-k
+    - rrf: reciprocal rank fusion, sum of 1 / (RRF_CONSTANT + rank) over the arrays of the group, higher is closer
+
+    Rows of a group must be contiguous in the input dataset, so that each group is processed within one chunk.
+    """
+
+    GROUP_COLUMN_NAME = "group_id"
+    SCORE_COLUMN_NAME = "score"
+    AGGREGATIONS = {"min_distance", "mean_distance", "rrf"}
+    RRF_CONSTANT = 60
+    SCORE_DESCRIPTIONS = {
+        "min_distance": "Smallest distance between the neighbor and the vectors of the group",
+        "mean_distance": "Mean distance between the neighbor and the vectors of the group having it as neighbor",
+        "rrf": "Reciprocal rank fusion score of the neighbor over the vectors of the group, higher is closer",
+    }
+
+    def __init__(
+        self,
+        nearest_neighbor: NearestNeighborSearch,
+        index_array_ids: np.array,
+        group_column: AnyStr,
+        aggregation: AnyStr = "min_distance",
+    ):
+        if aggregation not in self.AGGREGATIONS:
+            raise ValueError(f"Invalid group aggregation: '{aggregation}'")
+        self.nearest_neighbor = nearest_neighbor
+        self.index_array_ids = index_array_ids
+        self.group_column = group_column
+        self.aggregation = aggregation
+        self.score_column_name = (
+            self.SCORE_COLUMN_NAME if aggregation == "rrf" else NearestNeighborSearch.DISTANCE_COLUMN_NAME
+        )
+        self._data_loader = None
+
+    def get_column_descriptions(self, output_format: AnyStr = "long", neighbor_id_type: AnyStr = "id") -> Dict:
+        """Descriptions of the output columns of `find_neighbors_df` for a given output format"""
+        column_descriptions = {self.GROUP_COLUMN_NAME: f"Group ID from the '{self.group_column}' input column"}
+        if neighbor_id_type == "position":
+            neighbor_column_name = NearestNeighborSearch.NEIGHBOR_POSITION_COLUMN_NAME
+            column_descriptions[neighbor_column_name] = NearestNeighborSearch.NEIGHBOR_POSITION_DESCRIPTION
+        else:
+            neighbor_column_name = NearestNeighborSearch.NEIGHBOR_COLUMN_NAME
+            column_descriptions[neighbor_column_name] = NearestNeighborSearch.COLUMN_DESCRIPTIONS[neighbor_column_name]
+        column_descriptions[self.score_column_name] = self.SCORE_DESCRIPTIONS[self.aggregation]
+        return get_column_descriptions(
+            column_descriptions, {neighbor_column_name, self.score_column_name}, output_format
+        )
+
+    def get_array_column_types(self, output_format: AnyStr = "long", neighbor_id_type: AnyStr = "id") -> Dict:
+        """Element types of the output columns of `find_neighbors_df` which are JSON arrays in the output format"""
+        array_content_types = NearestNeighborSearch.get_array_column_types(
+            self.index_array_ids, output_format, neighbor_id_type
+        )
+        array_content_types[self.score_column_name] = array_content_types.pop(
+            NearestNeighborSearch.DISTANCE_COLUMN_NAME, "double"
+        )
+        return get_array_column_types(array_content_types, output_format)
+
+    def aggregate_neighbors(
+        self, group_codes: np.array, num_groups: int, neighbors: np.array, distances: np.array, num_neighbors: int
+    ) -> Tuple[np.array, np.array]:
+        """Aggregate matrices of neighbors of each array into matrices of top neighbors and scores of each group
+
+        Rows of the output matrices are sorted from closest to farthest neighbor, and padded with index -1.
+        """
+        found = neighbors >= 0
+        ranks = np.broadcast_to(np.arange(1, neighbors.shape[1] + 1), neighbors.shape)
+        candidates = pd.DataFrame(
+            {
+                "group": np.repeat(group_codes, neighbors.shape[1])[found.ravel()],
+                "neighbor": neighbors[found],
+                "value": distances[found] if self.aggregation != "rrf" else 1.0 / (self.RRF_CONSTANT + ranks[found]),
+            }
+        )
+        grouped_values = candidates.groupby(["group", "neighbor"], sort=False)["value"]
+        if self.aggregation == "min_distance":
+            scores = grouped_values.min()
+        elif self.aggregation == "mean_distance":
+            scores = grouped_values.mean()
+        else:
+            scores = grouped_values.sum()
+        scores = scores.rename("score").reset_index()
+        ascending = self.aggregation != "rrf"
+        scores = scores.sort_values(["group", "score", "neighbor"], ascending=[True, ascending, True], kind="mergesort")
+        group_ranks = scores.groupby("group", sort=False).cumcount().values
+        top = group_ranks < num_neighbors
+        group_neighbors = np.full((num_groups, num_neighbors), -1, dtype=np.int64)
+        group_scores = np.full((num_groups, num_neighbors), np.nan, dtype=np.float32)
+        group_neighbors[scores["group"].values[top], group_ranks[top]] = scores["neighbor"].values[top]
+        group_scores[scores["group"].values[top], group_ranks[top]] = scores["score"].values[top]
+        return (group_neighbors, group_scores)
+
+    def find_neighbors_df(
+        self,
+        df: pd.DataFrame,
+        feature_columns: List[AnyStr],
+        num_neighbors: int = 5,
+        input_schema: List[Dict] = None,
+        output_format: AnyStr = "long",
+        neighbor_id_type: AnyStr = "id",
+        **kwargs,
+    ) -> pd.DataFrame:
+        """Find nearest neighbors of each group of rows in a raw pandas DataFrame and format results"""
+        if self._data_loader is None:
+            self._data_loader = DataLoader(self.group_column, feature_columns, input_schema, unique_ids=False)
+        (group_ids, arrays) = self._data_loader.convert_df_to_arrays(df, verbose=False)
+        arrays = self.nearest_neighbor.transform_arrays(arrays)
+        (neighbors, distances) = self.nearest_neighbor.search_arrays(arrays, num_neighbors)
+        with performance_tracker.phase("group_aggregation", num_items=len(df.index)):
+            (group_codes, unique_group_ids) = pd.factorize(group_ids)
+            if np.any(group_codes < 0):
+                raise ValueError(f"Empty values in group column '{self.group_column}'")
+            (group_neighbors, group_scores) = self.aggregate_neighbors(
+                group_codes, len(unique_group_ids), neighbors, distances, num_neighbors
+            )
+        with performance_tracker.phase("dataframe_assembly", num_items=len(unique_group_ids)):
+            columns = {
+                self.GROUP_COLUMN_NAME: np.asarray(unique_group_ids),
+                **self.nearest_neighbor.get_neighbor_columns(
+                    group_neighbors, self.index_array_ids, output_format, neighbor_id_type
+                ),
+                self.score_column_name: group_scores,
+            }
+            output_df = build_output_df(columns, found=group_neighbors >= 0, output_format=output_format)
+        return output_df
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""Module to search several Nearest Neighbor Search indices in one pass over the input data"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import AnyStr, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from data_loader import DataLoader
+from nearest_neighbor.base import NearestNeighborSearch
+from nearest_neighbor.output_format import (
+    build_output_df,
+    encode_json_values,
+    get_array_column_types,
+    get_column_descriptions,
+)
+from performance_tracking import performance_tracker
+
+
+class MultiIndexNearestNeighborSearch:
+    """Search the same arrays (a.k.a. vectors) against several pre-computed indices built on the same embedding space
+
+    Each DataFrame chunk is parsed once, then searched against all indices concurrently.
+    Results are either kept as separate result sets tagged with the index name,
+    or merged into a global top-k across indices, which requires distances to be comparable.
+    Call `close` (or use the instance as a context manager) to shut down the search threads.
+    """
+
+    INDEX_NAME_COLUMN_NAME = "index_name"
+    COLUMN_DESCRIPTIONS = {
+        **NearestNeighborSearch.COLUMN_DESCRIPTIONS,
+        INDEX_NAME_COLUMN_NAME: "Name of the index folder containing the neighbor",
+    }
+    OUTPUT_MODES = {"separate", "merged"}
+
+    def __init__(self, indices: Dict[AnyStr, Tuple[NearestNeighborSearch, np.array]], output_mode: AnyStr = "separate"):
+        """
+        Args:
+            indices: Dictionary of (loaded NearestNeighborSearch instance, index array ids) by index name
+            output_mode: "separate" for one result set per index, "merged" for a global top-k across indices
+        """
+        if output_mode not in self.OUTPUT_MODES:
+            raise ValueError(f"Invalid multi-index output mode: '{output_mode}'")
+        num_dimensions = {nearest_neighbor.input_num_dimensions for (nearest_neighbor, _) in indices.values()}
+        if len(num_dimensions) != 1:
+            raise ValueError(f"Indices have different numbers of dimensions: {sorted(num_dimensions)}")
+        if output_mode == "merged":
+            distance_types = {self._get_distance_type(nearest_neighbor) for (nearest_neighbor, _) in indices.values()}
+            if len(distance_types) != 1:
+                raise ValueError(
+                    "Cannot merge neighbors of indices with different distance metrics: "
+                    + ", ".join(sorted(distance_types))
+                )
+            if any(nearest_neighbor.dimensionality_reduction for (nearest_neighbor, _) in indices.values()):
+                raise ValueError("Cannot merge neighbors of indices with dimensionality reduction")
+        self.indices = indices
+        self.output_mode = output_mode
+        self.num_dimensions = num_dimensions.pop()
+        self._data_loader = None
+        self._executor = ThreadPoolExecutor(max_workers=len(indices))  # Faiss and Annoy release the GIL
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self) -> None:
+        """Shut down the threads searching the indices"""
+        self._executor.shutdown(wait=True)
+
+    @staticmethod
+    def _get_distance_type(nearest_neighbor: NearestNeighborSearch) -> AnyStr:
+        """Identify the algorithm and distance metric, to check that distances of two indices can be compared"""
+        config = nearest_neighbor.get_config()
+        return f"{config['algorithm']}:{config.get('annoy_metric', config.get('faiss_index_type'))}"
+
+    @staticmethod
+    def _search_index(
+        nearest_neighbor: NearestNeighborSearch, arrays: np.array, num_neighbors: int
+    ) -> Tuple[np.array, np.array]:
+        """Apply the dimensionality reduction of an index, if any, then search it"""
+        return nearest_neighbor.search_arrays(nearest_neighbor.transform_arrays(arrays), num_neighbors)
+
+    def get_column_descriptions(self, output_format: AnyStr = "long", neighbor_id_type: AnyStr = "id") -> Dict:
+        """Descriptions of the output columns of `find_neighbors_df` for a given output format"""
+        column_descriptions = NearestNeighborSearch.get_column_descriptions(output_format, neighbor_id_type)
+        column_descriptions[self.INDEX_NAME_COLUMN_NAME] = self.COLUMN_DESCRIPTIONS[self.INDEX_NAME_COLUMN_NAME]
+        if self.output_mode == "merged" and output_format == "wide":
+            column_descriptions = get_column_descriptions(
+                column_descriptions, {self.INDEX_NAME_COLUMN_NAME}, output_format
+            )
+        return column_descriptions
+
+    def get_array_column_types(self, output_format: AnyStr = "long", neighbor_id_type: AnyStr = "id") -> Dict:
+        """Element types of the output columns of `find_neighbors_df` which are JSON arrays in the output format
+
+        Neighbor ids are typed as strings if the ids of the indices have different types.
+        """
+        array_content_types = {}
+        for (nearest_neighbor, index_array_ids) in self.indices.values():
+            for column_name, content_type in nearest_neighbor.get_array_column_types(
+                index_array_ids, output_format, neighbor_id_type
+            ).items():
+                if array_content_types.setdefault(column_name, content_type) != content_type:
+                    array_content_types[column_name] = "string"
+        if self.output_mode == "merged":
+            array_content_types[self.INDEX_NAME_COLUMN_NAME] = "string"
+        return get_array_column_types(array_content_types, output_format)
+
+    def find_neighbors_df(
+        self,
+        df: pd.DataFrame,
+        unique_id_column: AnyStr,
+        feature_columns: List[AnyStr],
+        num_neighbors: int = 5,
+        input_schema: List[Dict] = None,
+        output_format: AnyStr = "long",
+        neighbor_id_type: AnyStr = "id",
+        **kwargs,
+    ) -> pd.DataFrame:
+        """Find nearest neighbors in a raw pandas DataFrame across all indices and format results into a DataFrame"""
+        if self._data_loader is None:
+            self._data_loader = DataLoader(unique_id_column, feature_columns, input_schema)
+        (array_ids, arrays) = self._data_loader.convert_df_to_arrays(df, verbose=False)
+        if arrays.shape[1] != self.num_dimensions:
+            raise ValueError(
+                "Incompatible number of dimensions: "
+                + f"{self.num_dimensions} in indices, {arrays.shape[1]} in feature column(s)"
+            )
+        futures = {
+            index_name: self._executor.submit(self._search_index, nearest_neighbor, arrays, num_neighbors)
+            for index_name, (nearest_neighbor, _) in self.indices.items()
+        }
+        results = {index_name: future.result() for index_name, future in futures.items()}
+        with performance_tracker.phase("dataframe_assembly", num_items=len(df.index)):
+            if self.output_mode == "merged":
+                output_df = self._merge_results(array_ids, results, num_neighbors, output_format, neighbor_id_type)
+            else:
+                output_df = pd.concat(
+                    [
+                        self._format_results(
+                            array_ids, index_name, *results[index_name], output_format, neighbor_id_type
+                        )
+                        for index_name in self.indices
+                    ],
+                    ignore_index=True,
+                )
+        return output_df
+
+    def _format_results(
+        self,
+        array_ids: np.array,
+        index_name: AnyStr,
+        neighbors: np.array,
+        distances: np.array,
+        output_format: AnyStr = "long",
+        neighbor_id_type: AnyStr = "id",
+    ) -> pd.DataFrame:
+        """Format matrices of neighbor positions and distances of one index into a DataFrame"""
+        (nearest_neighbor, index_array_ids) = self.indices[index_name]
+        columns = {
+            NearestNeighborSearch.INPUT_COLUMN_NAME: array_ids,
+            self.INDEX_NAME_COLUMN_NAME: np.full(len(array_ids), index_name, dtype=object),
+            **nearest_neighbor.get_neighbor_columns(neighbors, index_array_ids, output_format, neighbor_id_type),
+            NearestNeighborSearch.DISTANCE_COLUMN_NAME: distances,
+        }
+        return build_output_df(columns, found=neighbors >= 0, output_format=output_format)
+
+    def _merge_results(
+        self,
+        array_ids: np.array,
+        results: Dict,
+        num_neighbors: int,
+        output_format: AnyStr = "long",
+        neighbor_id_type: AnyStr = "id",
+    ) -> pd.DataFrame:
+        """Keep the global top-k neighbors of each array across indices, sorted by increasing distance"""
+        index_names = list(self.indices.keys())
+        neighbor_columns = [
+            self.indices[index_name][0].get_neighbor_columns(
+                results[index_name][0], self.indices[index_name][1], output_format, neighbor_id_type
+            )
+            for index_name in index_names
+        ]
+        (neighbor_column_name,) = neighbor_columns[0].keys()
+        neighbor_values = np.concatenate([columns[neighbor_column_name] for columns in neighbor_columns], axis=1)
+        encoded_index_names = np.array(index_names, dtype=object)
+        if output_format == "wide":
+            encoded_index_names = encode_json_values(encoded_index_names)
+        neighbor_index_names = np.repeat(encoded_index_names, num_neighbors)
+        neighbor_index_names = np.broadcast_to(neighbor_index_names, neighbor_values.shape)
+        found = np.concatenate([results[index_name][0] >= 0 for index_name in index_names], axis=1)
+        distances = np.concatenate([results[index_name][1] for index_name in index_names], axis=1)
+        top_k = np.argsort(distances, axis=1, kind="stable")[:, :num_neighbors]
+        columns = {
+            NearestNeighborSearch.INPUT_COLUMN_NAME: array_ids,
+            self.INDEX_NAME_COLUMN_NAME: np.take_along_axis(neighbor_index_names, top_k, axis=1),
+            neighbor_column_name: np.take_along_axis(neighbor_values, top_k, axis=1),
+            NearestNeighborSearch.DISTANCE_COLUMN_NAME: np.take_along_axis(distances, top_k, axis=1),
+        }
+        return build_output_df(columns, found=np.take_along_axis(found, top_k, axis=1), output_format=output_format)
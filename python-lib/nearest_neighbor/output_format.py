@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Module to lay out nearest neighbor results into output DataFrames - *not* based on the Dataiku API"""
+
+import json
+from typing import AnyStr, Dict, Set
+
+import numpy as np
+import pandas as pd
+
+OUTPUT_FORMATS = {"long", "wide"}
+NEIGHBOR_ID_TYPES = {"id", "position"}
+ARRAY_CONTENT_TYPES = {"b": "boolean", "i": "bigint", "u": "bigint", "f": "double"}  # by numpy dtype kind
+
+
+def encode_json_values(values: np.array) -> np.array:
+    """Encode each value of an array as an ASCII JSON token (number or quoted string) into a numpy bytes array
+
+    Numeric arrays are encoded in vectorized form by numpy. Other values are encoded one by one,
+    so callers should encode index ids once and reuse the tokens across chunks.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind in {"i", "u", "f"}:
+        return values.astype(bytes)
+    tokens = [
+        json.dumps(value.item() if isinstance(value, np.generic) else value, default=str) for value in values.flat
+    ]
+    return np.array(tokens, dtype=bytes).reshape(values.shape)
+
+
+def join_json_arrays(tokens: np.array, found: np.array) -> np.array:
+    """Join a matrix of JSON tokens into one JSON array string per row, keeping only the tokens of neighbors found
+
+    All rows are laid out at once in a byte matrix of "[" + ("," + token) for each rank + "]",
+    from which separators and tokens of neighbors not found and the padding of fixed-width tokens are masked out.
+    Neighbors not found are padding at the end of each row, so the tokens kept are always a prefix of the row.
+    """
+    if tokens.dtype.kind != "S":
+        tokens = tokens.astype(bytes)
+    (num_rows, num_tokens) = tokens.shape
+    if num_rows == 0:
+        return np.array([], dtype=object)
+    token_width = tokens.dtype.itemsize
+    token_bytes = np.ascontiguousarray(tokens).view(np.uint8).reshape(num_rows, num_tokens, token_width)
+    # One piece per rank made of a separator and a token, plus a last piece for the closing bracket
+    pieces = np.zeros((num_rows, num_tokens + 1, token_width + 1), dtype=np.uint8)
+    kept = np.zeros(pieces.shape, dtype=bool)
+    pieces[:, :num_tokens, 0] = ord(",")
+    pieces[:, 0, 0] = ord("[")
+    pieces[:, num_tokens, 0] = ord("]")
+    pieces[:, :num_tokens, 1:] = token_bytes
+    kept[:, :num_tokens, 0] = found
+    kept[:, [0, num_tokens], 0] = True
+    kept[:, :num_tokens, 1:] = (token_bytes != 0) & found[:, :, np.newaxis]
+    # Gather kept bytes into a fixed-width bytes array with one row per input
+    kept = kept.reshape(num_rows, -1)
+    row_lengths = kept.sum(axis=1)
+    row_starts = np.cumsum(row_lengths) - row_lengths
+    kept_bytes = pieces.reshape(num_rows, -1)[kept]
+    row_bytes = np.zeros((num_rows, row_lengths.max()), dtype=np.uint8)
+    row_indices = np.repeat(np.arange(num_rows), row_lengths)
+    row_bytes[row_indices, np.arange(len(kept_bytes)) - row_starts[row_indices]] = kept_bytes
+    return row_bytes.view(f"S{row_bytes.shape[1]}").ravel().astype(str).astype(object)
+
+
+def build_output_df(columns: Dict[AnyStr, np.array], found: np.array, output_format: AnyStr = "long") -> pd.DataFrame:
+    """Lay out per-input columns (1-D arrays) and per-neighbor columns (2-D arrays, one column per neighbor rank)
+
+    - long: one row per pair of input and neighbor found. Float columns are written as float64,
+        for the schema of output datasets to stay the same as before distances were computed in float32.
+    - wide: one row per input, with per-neighbor columns as JSON arrays sorted by increasing distance.
+        Non-numeric per-neighbor columns must already be encoded as JSON tokens with `encode_json_values`.
+
+    Args:
+        columns: Dictionary of output column names (key) and arrays (value)
+        found: Boolean matrix of neighbors found, False for padding
+        output_format: "long" or "wide"
+
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Invalid output format: '{output_format}'")
+    num_neighbors = found.shape[1]
+    found_flat = found.ravel()
+    output = {}
+    for column_name, values in columns.items():
+        if output_format == "long":
+            if values.ndim == 1:
+                values = np.repeat(values, num_neighbors)[found_flat]
+            else:
+                values = values.ravel()[found_flat]
+            output[column_name] = values.astype(np.float64) if values.dtype.kind == "f" else values
+        else:
+            if values.ndim == 1:
+                output[column_name] = values
+            else:
+                if values.dtype.kind in {"i", "u", "f"}:
+                    values = encode_json_values(values)
+                output[column_name] = join_json_arrays(values, found)
+    return pd.DataFrame(output)
+
+
+def get_array_content_type(values: np.array) -> AnyStr:
+    """DSS storage type of the elements of JSON arrays made of these values, e.g. "bigint" for integer ids"""
+    values = np.asarray(values)
+    kind = values.dtype.kind
+    if kind == "O" and values.size:  # e.g. ids saved as an object array
+        kind = np.asarray([values.flat[0]]).dtype.kind
+    return ARRAY_CONTENT_TYPES.get(kind, "string")
+
+
+def get_array_column_types(
+    array_content_types: Dict[AnyStr, AnyStr], output_format: AnyStr = "long"
+) -> Dict[AnyStr, AnyStr]:
+    """Element types of per-neighbor columns which are JSON arrays in the output format, none in the long format"""
+    if output_format == "long":
+        return {}
+    return dict(array_content_types)
+
+
+def get_column_descriptions(
+    column_descriptions: Dict[AnyStr, AnyStr], per_neighbor_columns: Set[AnyStr], output_format: AnyStr = "long"
+) -> Dict[AnyStr, AnyStr]:
+    """Adapt descriptions of per-neighbor columns to the output format"""
+    if output_format == "long":
+        return dict(column_descriptions)
+    return {
+        column_name: f"Array of {description[0].lower()}{description[1:]}, sorted by increasing distance"
+        if column_name in per_neighbor_columns
+        else description
+        for column_name, description in column_descriptions.items()
+    }
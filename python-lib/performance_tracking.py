@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""Module to instrument recipe phases and build a per-run performance report - *not* based on the Dataiku API"""
+
+import cProfile
+import logging
+import platform
+import resource
+import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import AnyStr, Dict
+
+
+class PerformanceTracker:
+    """Accumulate timings, processed item counts and memory usage of each phase of a recipe run
+
+    Phases are identified by name (e.g. "dataset_read", "vector_parsing", "search") and may be entered many times,
+    typically once per chunk: durations and item counts are summed across calls.
+    Large arrays allocated while processing data are also counted, so that the memory of a chunk
+    can be measured by difference, like the seconds of its phases.
+    """
+
+    REPORT_FILE_NAME = "performance_report.json"
+    PROFILE_FILE_NAME = "performance_profile.prof"
+
+    def __init__(self):
+        self._lock = threading.Lock()  # phases may be recorded from several threads
+        self.reset()
+
+    def reset(self, recipe_name: AnyStr = "") -> None:
+        """Clear all recorded phases and start a new run"""
+        self.recipe_name = recipe_name
+        self.phases = OrderedDict()
+        self.start_time = perf_counter()
+        self.start_datetime = datetime.now(timezone.utc)
+        self.profiler = None
+        self.allocated_bytes = 0  # cumulative, including temporary buffers
+
+    @contextmanager
+    def phase(self, name: AnyStr, num_items: int = 0):
+        """Context manager to time a block of code and count the rows or queries it processed"""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, perf_counter() - start, num_items)
+
+    def record(self, name: AnyStr, duration: float, num_items: int = 0) -> None:
+        """Add a measured duration (in seconds) and a number of processed items to a phase"""
+        with self._lock:
+            phase = self.phases.setdefault(name, {"calls": 0, "seconds": 0.0, "items": 0})
+            phase["calls"] += 1
+            phase["seconds"] += duration
+            phase["items"] += int(num_items)
+
+    def record_allocation(self, num_bytes: int) -> None:
+        """Count the bytes of arrays and temporary buffers allocated to process data, e.g. parsed vectors"""
+        with self._lock:
+            self.allocated_bytes += int(num_bytes)
+
+    @staticmethod
+    def get_peak_rss_mb() -> float:
+        """Peak resident set size of the current process in megabytes
+
+        Read from VmHWM in /proc if available, as `ru_maxrss` is inherited from the parent process on Linux,
+        so that it may report the peak of the process which launched the recipe.
+        """
+        try:
+            with open("/proc/self/status") as status:
+                for line in status:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1]) / 1024  # in kilobytes
+        except (OSError, IndexError, ValueError):
+            pass
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":  # bytes on macOS, kilobytes on Linux
+            return max_rss / 1024 ** 2
+        return max_rss / 1024
+
+    @classmethod
+    def get_current_rss_mb(cls) -> float:
+        """Current resident set size of the process in megabytes, or the peak if /proc is not available"""
+        try:
+            with open("/proc/self/statm") as statm:
+                return int(statm.read().split()[1]) * resource.getpagesize() / 1024 ** 2
+        except (OSError, IndexError, ValueError):
+            return cls.get_peak_rss_mb()
+
+    def get_phase_seconds(self) -> Dict:
+        """Cumulative seconds spent in each phase so far, to measure phases of a single chunk by difference"""
+        with self._lock:
+            return {name: phase["seconds"] for name, phase in self.phases.items()}
+
+    def start_profiling(self) -> None:
+        """Start a cProfile session covering everything until `stop_profiling` is called"""
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def stop_profiling(self, file_path: AnyStr) -> None:
+        """Stop the cProfile session and dump its statistics to a local file, readable with `pstats`"""
+        if self.profiler is None:
+            raise ValueError("Profiling was not started")
+        self.profiler.disable()
+        self.profiler.dump_stats(file_path)
+        self.profiler = None
+
+    def get_report(self) -> Dict:
+        """Summarize recorded phases into a JSON-serializable report"""
+        phases = OrderedDict()
+        for name, phase in self.phases.items():
+            phases[name] = {
+                "calls": phase["calls"],
+                "seconds": round(phase["seconds"], 6),
+                "items": phase["items"],
+                "items_per_second": round(phase["items"] / phase["seconds"], 2)
+                if phase["items"] and phase["seconds"] > 0
+                else None,
+            }
+        return {
+            "recipe": self.recipe_name,
+            "start_time": self.start_datetime.isoformat(),
+            "total_seconds": round(perf_counter() - self.start_time, 6),
+            "peak_rss_mb": round(self.get_peak_rss_mb(), 2),
+            "python_version": platform.python_version(),
+            "phases": phases,
+        }
+
+    def log_report(self) -> Dict:
+        """Log a one-line summary per phase and return the full report"""
+        report = self.get_report()
+        for name, phase in report["phases"].items():
+            throughput = f", {phase['items_per_second']} items/s" if phase["items_per_second"] else ""
+            logging.info(f"Phase '{name}': {phase['seconds']:.2f} seconds in {phase['calls']} call(s){throughput}")
+        logging.info(f"Total: {report['total_seconds']:.2f} seconds, peak memory: {report['peak_rss_mb']} MB")
+        return report
+
+
+performance_tracker = PerformanceTracker()  # shared across modules for the duration of a recipe run
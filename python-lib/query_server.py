@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""Module to serve low-latency nearest neighbor lookups from a memory-resident index - *not* based on the Dataiku API
+
+The index folder produced by the Build Nearest Neighbor Search index recipe is loaded once from a local directory,
+for instance a managed folder on the local filesystem (see `dataiku.Folder.get_path`), or a copy of its content.
+Concurrent requests are grouped into micro-batches so that each call to `find_neighbors_array` serves several clients.
+
+Usage: python query_server.py --index-path /path/to/index_folder --port 8080 [--reload-root /path/to/index_folders]
+
+Reloading a new index version over HTTP is disabled unless a reload root is given at startup,
+in which case only index folders inside that directory can be loaded.
+"""
+
+import argparse
+import json
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+from typing import AnyStr, Dict, List, Tuple
+
+import numpy as np
+
+from dimensionality_reduction import DimensionalityReduction
+from nearest_neighbor.base import NearestNeighborSearch
+
+
+def resolve_reload_path(reload_root: AnyStr, index_path: AnyStr) -> AnyStr:
+    """Resolve an index folder path given relative to the reload root, and raise if it points outside of it"""
+    reload_root = os.path.realpath(reload_root)
+    resolved_path = os.path.realpath(os.path.join(reload_root, index_path))
+    if resolved_path == reload_root or os.path.commonpath([reload_root, resolved_path]) != reload_root:
+        raise ValueError(f"Index path '{index_path}' is not a subdirectory of the reload root")
+    return resolved_path
+
+
+def load_local_index(index_path: AnyStr) -> Tuple[NearestNeighborSearch, np.array]:
+    """Load a pre-computed index and its array ids from a local copy of an index folder"""
+    with open(os.path.join(index_path, NearestNeighborSearch.CONFIG_FILE_NAME)) as config_file:
+        index_config = json.load(config_file)
+    nearest_neighbor = NearestNeighborSearch(**index_config)
+    nearest_neighbor.load_index(os.path.join(index_path, nearest_neighbor.INDEX_FILE_NAME))
+    if index_config.get("dimensionality_reduction"):
+        dimensionality_reduction_path = os.path.join(index_path, index_config["dimensionality_reduction"]["file_name"])
+        nearest_neighbor.dimensionality_reduction = DimensionalityReduction.load(dimensionality_reduction_path)
+    array_ids_path = os.path.join(index_path, nearest_neighbor.ARRAY_IDS_FILE_NAME)
+    index_array_ids = np.load(array_ids_path, allow_pickle=True)["arr_0"]
+    return (nearest_neighbor, index_array_ids)
+
+
+class NeighborQueryService:
+    """Keep an index in memory and answer concurrent queries by micro-batches
+
+    Queries are queued and a single worker thread stacks them into one array, up to `max_batch_size` vectors
+    or until `max_wait_seconds` have elapsed since the first queued query.
+    A new index version can be loaded with `swap_index` while queries are being served:
+    batches in flight finish on the previous version, and the following ones use the new version.
+    Call `close` (or use the service as a context manager) to stop the worker thread.
+    """
+
+    DEFAULT_TIMEOUT_SECONDS = 30.0
+    _STOP = None  # queued by `close` to stop the worker thread
+
+    def __init__(self, index_path: AnyStr, max_batch_size: int = 256, max_wait_seconds: float = 0.002):
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self._queue = queue.Queue()
+        self._swap_lock = threading.Lock()
+        self._index_version = 0
+        self._index = None
+        self.swap_index(index_path)
+        self._worker = threading.Thread(target=self._serve_batches, name="neighbor-query-batcher", daemon=True)
+        self._worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def index_version(self) -> int:
+        return self._index_version
+
+    @property
+    def num_dimensions(self) -> int:
+        return self._index[0].input_num_dimensions
+
+    def swap_index(self, index_path: AnyStr) -> int:
+        """Load an index folder fully in memory, then make it the one used by the next batches"""
+        with self._swap_lock:  # serialize concurrent reloads, queries are not blocked while loading
+            start = perf_counter()
+            (nearest_neighbor, index_array_ids) = load_local_index(index_path)
+            # Convert ids to native Python objects once, so that responses are JSON-serializable
+            index_version = self._index_version + 1
+            self._index = (nearest_neighbor, index_array_ids.tolist(), index_version)  # atomic reference swap
+            self._index_version = index_version
+            logging.info(
+                f"Serving index version {self._index_version} from '{index_path}' "
+                + f"loaded in {perf_counter() - start:.2f} seconds"
+            )
+            return self._index_version
+
+    def query(
+        self, arrays: np.array, num_neighbors: int = 5, timeout: float = DEFAULT_TIMEOUT_SECONDS
+    ) -> List[List[Dict]]:
+        """Find nearest neighbors of each array (a.k.a. vector) and return lists of neighbor ids and distances"""
+        return self.query_with_version(arrays, num_neighbors, timeout)[1]
+
+    def query_with_version(
+        self, arrays: np.array, num_neighbors: int = 5, timeout: float = DEFAULT_TIMEOUT_SECONDS
+    ) -> Tuple[int, List[List[Dict]]]:
+        """Same as `query`, also returning the version of the index which served the query"""
+        if isinstance(num_neighbors, bool) or not isinstance(num_neighbors, (int, np.integer)) or num_neighbors < 1:
+            raise ValueError(f"Invalid number of neighbors: {num_neighbors}, must be a positive integer")
+        arrays = np.ascontiguousarray(np.atleast_2d(np.asarray(arrays, dtype=np.float32)))
+        if arrays.ndim != 2:
+            raise ValueError(f"Query vectors must be a list of arrays, got shape {arrays.shape}")
+        if arrays.shape[1] != self.num_dimensions:
+            raise ValueError(
+                "Incompatible number of dimensions: "
+                + f"{self.num_dimensions} in index, {arrays.shape[1]} in query vectors"
+            )
+        if not self._worker.is_alive():
+            raise RuntimeError("Query service is closed")
+        future = Future()
+        self._queue.put((arrays, int(num_neighbors), future))
+        return future.result(timeout=timeout)
+
+    def close(self, timeout: float = DEFAULT_TIMEOUT_SECONDS) -> None:
+        """Stop the worker thread after the queries already queued are served"""
+        if self._worker.is_alive():
+            self._queue.put(self._STOP)
+            self._worker.join(timeout)
+
+    def _collect_batch(self) -> Tuple[List[Tuple], bool]:
+        """Block until a query arrives, then gather other queued queries within the waiting window
+
+        Returns:
+            Tuple with the list of queued queries and whether the service was closed
+        """
+        request = self._queue.get()
+        if request is self._STOP:
+            return ([], True)
+        batch = [request]
+        batch_size = len(request[0])
+        deadline = perf_counter() + self.max_wait_seconds
+        while batch_size < self.max_batch_size:
+            remaining = deadline - perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is self._STOP:
+                return (batch, True)
+            batch.append(request)
+            batch_size += len(request[0])
+        return (batch, False)
+
+    def _serve_batches(self) -> None:
+        stopped = False
+        while not stopped:
+            (batch, stopped) = self._collect_batch()
+            if batch:
+                self._serve_batch(batch)
+
+    def _serve_batch(self, batch: List[Tuple]) -> None:
+        """Search all queries of a batch at once, then set the result or error of each query separately"""
+        (nearest_neighbor, index_array_ids, index_version) = self._index
+        valid_batch = []
+        for (request_arrays, request_num_neighbors, future) in batch:
+            if request_arrays.shape[1] == nearest_neighbor.input_num_dimensions:
+                valid_batch.append((request_arrays, request_num_neighbors, future))
+            else:  # the index was swapped to one with other dimensions after the query was checked
+                error_message = (
+                    "Incompatible number of dimensions: "
+                    + f"{nearest_neighbor.input_num_dimensions} in index, {request_arrays.shape[1]} in query vectors"
+                )
+                future.set_exception(ValueError(error_message))
+        if not valid_batch:
+            return
+        try:
+            arrays = nearest_neighbor.transform_arrays(np.concatenate([request[0] for request in valid_batch], axis=0))
+            num_neighbors = max(request[1] for request in valid_batch)
+            index_distance_pairs = nearest_neighbor.find_neighbors_array(arrays, num_neighbors)
+        except Exception as e:
+            for request in valid_batch:
+                request[2].set_exception(e)
+            return
+        i = 0
+        for (request_arrays, request_num_neighbors, future) in valid_batch:
+            try:
+                results = []
+                for pairs in index_distance_pairs[i : (i + len(request_arrays))]:  # noqa
+                    results.append(
+                        [
+                            {"id": index_array_ids[int(index)], "distance": float(distance)}
+                            for (index, distance) in pairs[:request_num_neighbors]
+                            if int(index) >= 0  # Faiss pads missing neighbors with -1
+                        ]
+                    )
+                future.set_result((index_version, results))
+            except Exception as e:
+                future.set_exception(e)
+            i += len(request_arrays)
+
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    """HTTP handler exposing GET /health, POST /search and POST /reload with JSON bodies"""
+
+    service = None  # NeighborQueryService instance, set by `make_server`
+    reload_root = None  # directory of the index folders allowed on POST /reload, which is disabled if None
+
+    def _send_json(self, status: int, body: Dict) -> None:
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_json(self) -> Dict:
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not isinstance(body, dict):
+            raise ValueError("Request body must be a JSON object")
+        return body
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok", "index_version": self.service.index_version})
+        else:
+            self._send_json(404, {"error": f"Unknown path: {self.path}"})
+
+    def do_POST(self):
+        try:
+            body = self._read_json()
+            if self.path == "/search":
+                (index_version, neighbors) = self.service.query_with_version(
+                    body["vectors"], body.get("num_neighbors", 5)
+                )
+                self._send_json(200, {"index_version": index_version, "neighbors": neighbors})
+            elif self.path == "/reload":
+                if self.reload_root is None:
+                    self._send_json(403, {"error": "Reloading is disabled: start the server with a reload root"})
+                    return
+                index_version = self.service.swap_index(resolve_reload_path(self.reload_root, body["index_path"]))
+                self._send_json(200, {"index_version": index_version})
+            else:
+                self._send_json(404, {"error": f"Unknown path: {self.path}"})
+        except FutureTimeoutError:  # checked first, as it is an OSError from Python 3.11
+            self._send_json(503, {"error": "Query timed out: the service is overloaded"})
+        except (KeyError, TypeError, ValueError, OSError) as e:
+            self._send_json(400, {"error": f"{type(e).__name__}: {e}"})
+        except Exception as e:
+            logging.exception(f"Error while handling {self.path}")
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+
+def make_server(
+    service: NeighborQueryService, host: AnyStr = "127.0.0.1", port: int = 8080, reload_root: AnyStr = None
+) -> ThreadingHTTPServer:
+    """Create a multi-threaded HTTP server bound to a query service - use port 0 to pick a free port
+
+    POST /reload only loads index folders inside `reload_root`, and is disabled if it is None.
+    """
+    handler = type(
+        "BoundQueryRequestHandler", (QueryRequestHandler,), {"service": service, "reload_root": reload_root}
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve nearest neighbor lookups from a pre-computed index folder")
+    parser.add_argument("--index-path", required=True, help="Local directory containing the index folder files")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-batch-size", type=int, default=256, help="Maximum number of vectors per batch")
+    parser.add_argument("--max-wait-ms", type=float, default=2.0, help="Maximum wait to fill a batch")
+    parser.add_argument(
+        "--reload-root", default=None, help="Directory of index folders allowed on POST /reload, disabled by default"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    service = NeighborQueryService(args.index_path, args.max_batch_size, args.max_wait_ms / 1000)
+    server = make_server(service, args.host, args.port, args.reload_root)
+    logging.info(f"Serving nearest neighbor lookups on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,9 +3,11 @@
 
 import logging
 import functools
-from typing import Callable, AnyStr
+from typing import Callable, AnyStr, Iterator
 from time import perf_counter
 
+import numpy as np
+
 
 def time_logging(log_message: AnyStr):
     """Decorator to log timing with a custom message"""
@@ -23,3 +25,27 @@ def time_logging(log_message: AnyStr):
         return wrapper
 
     return inner_function
+
+
+def iter_array_blocks(arrays: np.array, block_size: int) -> Iterator[np.array]:
+    """Iterate over contiguous copies of consecutive blocks of rows of an array
+
+    Memory-mapped arrays are mapped again for each block and unmapped after the copy,
+    so that pages read from disk do not accumulate in the resident memory of the process.
+    """
+    block_size = max(1, int(block_size))
+    row_bytes = arrays.dtype.itemsize * int(np.prod(arrays.shape[1:]))
+    for start in range(0, len(arrays), block_size):
+        stop = min(start + block_size, len(arrays))
+        if isinstance(arrays, np.memmap) and arrays.filename:
+            block = np.memmap(
+                arrays.filename,
+                dtype=arrays.dtype,
+                mode="r",
+                offset=arrays.offset + start * row_bytes,
+                shape=(stop - start,) + arrays.shape[1:],
+            )
+            yield np.array(block)
+            del block
+        else:
+            yield np.ascontiguousarray(arrays[start:stop])
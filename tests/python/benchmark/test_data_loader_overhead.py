@@ -0,0 +1,102 @@
+import json
+import math
+import os
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from data_loader import DataLoader
+
+NUM_CHUNKS = int(os.environ.get("BENCHMARK_NUM_CHUNKS", 20))
+CHUNK_SIZE = int(os.environ.get("BENCHMARK_CHUNK_SIZE", 1000))
+ARRAY_LENGTH = int(os.environ.get("BENCHMARK_ARRAY_LENGTH", 128))
+
+
+def convert_df_to_arrays_per_chunk_reference(df, unique_id_column, feature_columns):
+    """Conversion as done before single-pass decoding: separate validation passes, type sniffing on every chunk
+    and row-by-row parsing, run twice per chunk to count the array length then load the arrays"""
+    if not df[unique_id_column].is_unique:
+        raise ValueError("Duplicate ids")
+    for column in feature_columns:
+        if df[column].isnull().values.any():
+            raise ValueError(f"Empty values in column '{column}'")
+
+    def load_arrays(df, array_length):
+        arrays = np.empty(shape=(len(df.index), array_length))
+        i = 0
+        for column in feature_columns:
+            if df[column].dtype == "object" and df[column].str.startswith("[").all():
+                column_array = np.stack(df[column].apply(DataLoader.load_array_from_string), axis=0)
+                arrays[:, i : (i + column_array.shape[1])] = column_array  # noqa
+                i += column_array.shape[1]
+            else:
+                arrays[:, i] = df[column].values.astype(np.float32)
+                i += 1
+        return np.ascontiguousarray(arrays[:, :i], dtype=np.float32)
+
+    array_length = load_arrays(df.head(1), DataLoader.MAX_ARRAY_LENGTH).shape[1]
+    return (df[unique_id_column].values, load_arrays(df, array_length))
+
+
+def make_chunks():
+    random_state = np.random.RandomState(0)
+    chunks = []
+    for chunk_index in range(NUM_CHUNKS):
+        vectors = random_state.rand(CHUNK_SIZE, ARRAY_LENGTH).astype(np.float32)
+        chunks.append(
+            pd.DataFrame(
+                {
+                    "id": [f"{chunk_index}_{i}" for i in range(CHUNK_SIZE)],
+                    "embedding": [json.dumps(vector.tolist()) for vector in vectors],
+                    "score": random_state.rand(CHUNK_SIZE),
+                }
+            )
+        )
+    return chunks
+
+
+def count_json_decoding_calls(monkeypatch, function):
+    """Count the calls to `json.loads` made by a function, a proxy of per-row Python work independent of timing"""
+    json_loads = json.loads
+    num_calls = [0]
+
+    def counting_json_loads(*args, **kwargs):
+        num_calls[0] += 1
+        return json_loads(*args, **kwargs)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(json, "loads", counting_json_loads)
+        function()
+    return num_calls[0]
+
+
+def test_per_chunk_conversion_overhead(monkeypatch):
+    chunks = make_chunks()
+    start = perf_counter()
+    reference_arrays = [convert_df_to_arrays_per_chunk_reference(df, "id", ["embedding", "score"])[1] for df in chunks]
+    reference_seconds = perf_counter() - start
+    start = perf_counter()
+    data_loader = DataLoader("id", ["embedding", "score"])
+    arrays = [data_loader.convert_df_to_arrays(df, verbose=False)[1] for df in chunks]
+    single_pass_seconds = perf_counter() - start
+    reference_calls = count_json_decoding_calls(
+        monkeypatch,
+        lambda: [convert_df_to_arrays_per_chunk_reference(df, "id", ["embedding", "score"]) for df in chunks],
+    )
+    data_loader = DataLoader("id", ["embedding", "score"])
+    single_pass_calls = count_json_decoding_calls(
+        monkeypatch, lambda: [data_loader.convert_df_to_arrays(df, verbose=False) for df in chunks]
+    )
+    print(
+        f"DataLoader on {NUM_CHUNKS} chunks of {CHUNK_SIZE} rows x {ARRAY_LENGTH} dimensions: "
+        + f"{1000 * reference_seconds / NUM_CHUNKS:.1f} ms per chunk before, "
+        + f"{1000 * single_pass_seconds / NUM_CHUNKS:.1f} ms per chunk with batched decoding "
+        + f"(ratio {reference_seconds / single_pass_seconds:.2f}x), "
+        + f"{reference_calls} JSON decoding calls before, {single_pass_calls} after"
+    )
+    assert all(np.array_equal(expected, actual) for expected, actual in zip(reference_arrays, arrays))
+    # Timings are only reported, as they vary across machines: the work done per chunk is asserted instead
+    assert reference_calls == NUM_CHUNKS * (CHUNK_SIZE + 1)
+    # One call per batch of rows, plus one on the first row to detect lengths
+    assert single_pass_calls == NUM_CHUNKS * math.ceil(CHUNK_SIZE / DataLoader.DECODE_BATCH_SIZE) + 1
@@ -0,0 +1,57 @@
+import json
+import os
+import subprocess
+import sys
+
+PLUGIN_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+LOCAL_DATAIKU_PATH = os.path.join(PLUGIN_ROOT, "tests", "python", "local_dataiku")
+STARTUP_BUDGET_SECONDS = float(os.environ.get("STARTUP_BUDGET_SECONDS", 3.0))
+
+STARTUP_SCRIPT = """
+import json
+import sys
+from time import perf_counter
+
+import dataiku
+
+dataiku.configure(
+    sys.argv[1],
+    recipe_config={"unique_id_column": "id", "feature_columns": ["embedding"], "num_neighbors": 5},
+    inputs={"index_folder": ["index"], "input_dataset": ["input"]},
+    outputs={"output_dataset": ["output"]},
+)
+with open(f"{sys.argv[1]}/datasets/input.schema.json", "w") as schema_file:
+    json.dump([{"name": "id", "type": "string"}, {"name": "embedding", "type": "array"}], schema_file)
+start = perf_counter()
+from dku_param_loading import load_search_recipe_params
+from nearest_neighbor.base import NearestNeighborSearch
+from dku_io_utils import download_file_from_folder_to_tmp, load_index_from_folder, process_dataset_chunks
+import_seconds = perf_counter() - start
+params = load_search_recipe_params()
+print(json.dumps({
+    "import_seconds": import_seconds,
+    "startup_seconds": perf_counter() - start,
+    "api_calls": dict(dataiku.API_CALLS),
+    "heavy_modules": sorted(m for m in ("faiss", "annoy", "tqdm") if m in sys.modules),
+}))
+"""
+
+
+def run_startup_script(root):
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([os.path.join(PLUGIN_ROOT, "python-lib"), LOCAL_DATAIKU_PATH])}
+    output = subprocess.run(
+        [sys.executable, "-c", STARTUP_SCRIPT, root], env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def test_search_recipe_startup_budget(tmp_path):
+    result = run_startup_script(str(tmp_path))
+    print(f"Search recipe startup: {result}")
+    # Index backends and progress bars are only imported when needed. pandas and numpy are not checked,
+    # as the real `dataiku` package imports them anyway before any plugin code runs.
+    assert result["heavy_modules"] == []
+    assert result["api_calls"].get("api_client", 0) <= 1
+    assert result["api_calls"].get("get_definition", 0) <= 1
+    assert result["api_calls"].get("read_schema", 0) <= 1
+    assert result["startup_seconds"] < STARTUP_BUDGET_SECONDS
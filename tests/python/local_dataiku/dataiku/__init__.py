@@ -0,0 +1,308 @@
+"""Local stand-in for the `dataiku` package, backed by CSV files and directories, to run recipes offline
+
+Shared by the offline end-to-end tests and the benchmarks, which check the number of API calls in `API_CALLS`.
+Only the parts of the API used by this plugin are implemented. A run is described by `configure`:
+- datasets are CSV files `<root>/datasets/<name>.csv` with their schema in `<name>.schema.json`,
+    or one CSV file per partition `<root>/datasets/<name>/<partition>.csv` if the dataset is partitioned
+- managed folders are directories `<root>/folders/<name>`
+- recipe config, input/output roles, flow variables and partitions are held in memory
+"""
+
+import json
+import os
+import shutil
+from collections import Counter
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+API_CALLS = Counter()  # number of calls to the (remote in DSS) public API and to schema lookups, by method name
+PROJECT_KEY = "OFFLINE"
+_runtime = {}
+
+INTEGER_TYPES = {"tinyint", "smallint", "int", "bigint"}  # inferred by pandas, as they may be read as float if empty
+FLOAT_TYPES = {"float", "double"}
+
+
+def configure(
+    root,
+    recipe_config=None,
+    inputs=None,
+    outputs=None,
+    flow_variables=None,
+    read_partitions=None,
+    write_partitions=None,
+    folder_partitioning=None,
+):
+    """Set the local root directory and the context of the next recipe run
+
+    Args:
+        root: Local directory holding datasets and folders
+        recipe_config: Dictionary returned by `customrecipe.get_recipe_config`
+        inputs: Dictionary of lists of input names by role
+        outputs: Dictionary of lists of output names by role
+        flow_variables: Dictionary returned by `get_flow_variables`, e.g. DKU_DST_<dimension> partition values
+        read_partitions: Dictionary of lists of partitions read by input name
+        write_partitions: Dictionary of the partition written by output name
+        folder_partitioning: Dictionary of partitioning config of folders by name, as in the folder definition
+    """
+    API_CALLS.clear()
+    _runtime.clear()
+    _runtime.update(
+        {
+            "root": root,
+            "recipe_config": recipe_config or {},
+            "inputs": inputs or {},
+            "outputs": outputs or {},
+            "flow_variables": flow_variables or {},
+            "read_partitions": read_partitions or {},
+            "write_partitions": write_partitions or {},
+            "folder_partitioning": folder_partitioning or {},
+        }
+    )
+    os.makedirs(os.path.join(root, "datasets"), exist_ok=True)
+    os.makedirs(os.path.join(root, "folders"), exist_ok=True)
+
+
+def default_project_key():
+    return PROJECT_KEY
+
+
+def get_flow_variables():
+    return dict(_runtime["flow_variables"])
+
+
+def _short_name(name):
+    return name.split(".")[-1]
+
+
+class Dataset:
+    def __init__(self, name, project_key=None):
+        self.short_name = _short_name(name)
+        self.project_key = project_key or PROJECT_KEY
+        self.name = self.full_name = f"{self.project_key}.{self.short_name}"
+        self.read_partitions = _runtime["read_partitions"].get(self.short_name)
+        self.writePartition = _runtime["write_partitions"].get(self.short_name)
+
+    @property
+    def _base_path(self):
+        return os.path.join(_runtime["root"], "datasets", self.short_name)
+
+    def _partition_paths(self):
+        if os.path.isdir(self._base_path):
+            partitions = self.read_partitions
+            if not partitions:
+                partitions = sorted(path[:-4] for path in os.listdir(self._base_path) if path.endswith(".csv"))
+            return [os.path.join(self._base_path, f"{partition}.csv") for partition in partitions]
+        return [f"{self._base_path}.csv"]
+
+    def _read_schema_file(self):
+        schema_path = f"{self._base_path}.schema.json"
+        if not os.path.exists(schema_path):
+            return []
+        with open(schema_path) as schema_file:
+            return json.load(schema_file)
+
+    def read_schema(self, raise_if_empty=True):
+        API_CALLS["read_schema"] += 1
+        schema = self._read_schema_file()
+        if not schema and raise_if_empty:
+            raise Exception(f"No column in schema of {self.full_name}")
+        return schema
+
+    def write_schema(self, columns, dropAndCreate=False):
+        with open(f"{self._base_path}.schema.json", "w") as schema_file:
+            json.dump(columns, schema_file)
+
+    def write_schema_from_dataframe(self, df, dropAndCreate=False):
+        self.write_schema(get_schema_from_df(df), dropAndCreate)
+
+    def _get_dtypes(self, columns=None):
+        dtypes = {}
+        for column in self._read_schema_file():
+            if columns is not None and column["name"] not in columns:
+                continue
+            if column["type"] in FLOAT_TYPES:
+                dtypes[column["name"]] = np.float64
+            elif column["type"] not in INTEGER_TYPES:
+                dtypes[column["name"]] = object
+        return dtypes
+
+    def get_dataframe(self, columns=None, limit=None, infer_with_pandas=True):
+        dfs = []
+        for path in self._partition_paths():
+            dtype = None if infer_with_pandas else self._get_dtypes(columns)
+            dfs.append(pd.read_csv(path, usecols=columns, dtype=dtype, nrows=limit))
+        df = pd.concat(dfs, ignore_index=True)
+        return df.head(limit) if limit else df
+
+    def iter_dataframes(self, chunksize=10000, infer_with_pandas=True, columns=None):
+        for path in self._partition_paths():
+            dtype = None if infer_with_pandas else self._get_dtypes(columns)
+            with pd.read_csv(path, usecols=columns, dtype=dtype, chunksize=int(chunksize)) as reader:
+                for df in reader:
+                    yield df
+
+    @contextmanager
+    def get_writer(self):
+        if self.writePartition:
+            os.makedirs(self._base_path, exist_ok=True)
+            path = os.path.join(self._base_path, f"{self.writePartition}.csv")
+        else:
+            path = f"{self._base_path}.csv"
+        writer = _DatasetWriter(path)
+        try:
+            yield writer
+        finally:
+            writer.close()
+
+    def get_last_metric_values(self):
+        return _ComputedMetricValues(self.short_name)
+
+
+class _DatasetWriter:
+    def __init__(self, path):
+        self.file = open(path, "w", newline="")
+        self.header = True
+
+    def write_dataframe(self, df):
+        df.to_csv(self.file, index=False, header=self.header)
+        self.header = False
+
+    def close(self):
+        self.file.close()
+
+
+def get_schema_from_df(df):
+    schema = []
+    for column_name, dtype in df.dtypes.items():
+        if pd.api.types.is_integer_dtype(dtype):
+            column_type = "bigint"
+        elif pd.api.types.is_float_dtype(dtype):
+            column_type = "double" if dtype == np.float64 else "float"
+        elif pd.api.types.is_bool_dtype(dtype):
+            column_type = "boolean"
+        else:
+            column_type = "string"
+        schema.append({"name": column_name, "type": column_type})
+    return schema
+
+
+def _count_csv_rows(path):
+    num_lines = 0
+    with open(path, "rb") as csv_file:
+        for block in iter(lambda: csv_file.read(2 ** 20), b""):
+            num_lines += block.count(b"\n")
+    return max(num_lines - 1, 0)
+
+
+class _ComputedMetricValues:
+    metrics = {}  # record counts by (dataset name, partition), computed by `compute_metrics`
+
+    def __init__(self, dataset_name):
+        self.dataset_name = dataset_name
+
+    def get_global_data(self, metric_id):
+        return {"dataType": "BIGINT", "value": str(self.metrics[(self.dataset_name, None)])}
+
+    def get_partition_data(self, partition, metric_id):
+        return {"dataType": "BIGINT", "value": str(self.metrics[(self.dataset_name, partition)])}
+
+
+class ComputedMetrics:
+    @staticmethod
+    def get_value_from_data(data):
+        return int(data["value"]) if data["dataType"] == "BIGINT" else data["value"]
+
+
+class Folder:
+    def __init__(self, name, project_key=None):
+        self.name = _short_name(name)
+        self.read_partitions = _runtime["read_partitions"].get(self.name)
+        self.writePartition = _runtime["write_partitions"].get(self.name)
+
+    def get_id(self):
+        return self.name
+
+    def get_name(self):
+        return self.name
+
+    def get_path(self):
+        path = os.path.join(_runtime["root"], "folders", self.name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _local_path(self, path):
+        local_path = os.path.join(self.get_path(), path.lstrip("/"))
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        return local_path
+
+    def upload_stream(self, path, stream):
+        with open(self._local_path(path), "wb") as local_file:
+            if hasattr(stream, "read"):
+                shutil.copyfileobj(stream, local_file, length=2 ** 20)
+            else:
+                for data in stream:
+                    local_file.write(data)
+
+    def get_download_stream(self, path):
+        return open(self._local_path(path), "rb")
+
+    def write_json(self, path, obj):
+        with open(self._local_path(path), "w") as json_file:
+            json.dump(obj, json_file)
+
+    def read_json(self, path):
+        with open(self._local_path(path)) as json_file:
+            return json.load(json_file)
+
+    def get_path_details(self, path="/"):
+        local_path = os.path.join(self.get_path(), path.lstrip("/"))
+        return {"exists": os.path.exists(local_path), "directory": os.path.isdir(local_path), "fullPath": path}
+
+
+class _DSSDataset:
+    def __init__(self, dataset_name):
+        self.dataset_name = dataset_name
+
+    def compute_metrics(self, metric_ids=None, partition=None):
+        API_CALLS["compute_metrics"] += 1
+        dataset = Dataset(self.dataset_name)
+        if partition is None:
+            num_rows = sum(_count_csv_rows(path) for path in dataset._partition_paths())
+        else:
+            num_rows = _count_csv_rows(os.path.join(dataset._base_path, f"{partition}.csv"))
+        _ComputedMetricValues.metrics[(self.dataset_name, partition)] = num_rows
+
+
+class _DSSManagedFolder:
+    def __init__(self, folder_id):
+        self.folder_id = folder_id
+
+    def get_definition(self):
+        API_CALLS["get_definition"] += 1
+        partitioning = _runtime["folder_partitioning"].get(self.folder_id)
+        return {"id": self.folder_id, "partitioning": partitioning} if partitioning else {"id": self.folder_id}
+
+
+class _DSSProject:
+    def __init__(self, project_key):
+        self.project_key = project_key
+
+    def get_dataset(self, dataset_name):
+        return _DSSDataset(dataset_name)
+
+    def get_managed_folder(self, folder_id):
+        return _DSSManagedFolder(folder_id)
+
+
+class _DSSClient:
+    def get_project(self, project_key):
+        API_CALLS["get_project"] += 1
+        return _DSSProject(project_key)
+
+
+def api_client():
+    API_CALLS["api_client"] += 1
+    return _DSSClient()
@@ -0,0 +1,15 @@
+"""Local stand-in for `dataiku.customrecipe`, returning the recipe context set by `dataiku.configure`"""
+
+from dataiku import _runtime
+
+
+def get_recipe_config():
+    return dict(_runtime["recipe_config"])
+
+
+def get_input_names_for_role(role):
+    return list(_runtime["inputs"].get(role, []))
+
+
+def get_output_names_for_role(role):
+    return list(_runtime["outputs"].get(role, []))
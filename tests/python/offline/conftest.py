@@ -0,0 +1,15 @@
+import pytest
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "large: end-to-end runs on OFFLINE_LARGE_NUM_ROWS rows, run with `-m large`")
+
+
+def pytest_collection_modifyitems(config, items):
+    """Skip tests marked as large unless they are selected with `-m large`"""
+    if "large" in (config.option.markexpr or ""):
+        return
+    skip_large = pytest.mark.skip(reason="large test, run with `-m large`")
+    for item in items:
+        if "large" in item.keywords:
+            item.add_marker(skip_large)
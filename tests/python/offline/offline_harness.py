@@ -0,0 +1,127 @@
+"""Helpers to generate local datasets and run recipe scripts end to end with the local `dataiku` stand-in"""
+
+import json
+import multiprocessing
+import os
+import runpy
+import traceback
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+import dataiku
+from performance_tracking import PerformanceTracker
+
+PLUGIN_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+NUM_ROWS = int(os.environ.get("OFFLINE_NUM_ROWS", 20000))
+LARGE_NUM_ROWS = int(os.environ.get("OFFLINE_LARGE_NUM_ROWS", 1000000))  # tests marked "large", run with `-m large`
+NUM_DIMENSIONS = int(os.environ.get("OFFLINE_NUM_DIMENSIONS", 64))
+MIN_ROWS_PER_SECOND = float(os.environ.get("OFFLINE_MIN_ROWS_PER_SECOND", 5000))  # in each I/O phase
+MODULES_MEMORY_MB = 64  # modules imported by a recipe after the baseline is measured, e.g. faiss
+WRITE_BLOCK_SIZE = 2 ** 16
+
+
+def get_num_queries(num_rows):
+    return int(os.environ.get("OFFLINE_NUM_QUERIES", min(num_rows, 5000)))
+
+
+def get_max_memory_mb(memory_budget_mb, num_rows, num_index_copies=1, num_dimensions=NUM_DIMENSIONS):
+    """Ceiling of the peak memory of a recipe run: its memory budget, plus the index vectors held in memory
+
+    The index recipe in out-of-core mode holds two copies: the index, and the pages of the memory-mapped scratch file.
+    """
+    index_mb = num_rows * num_dimensions * 4 / 1024 ** 2
+    return memory_budget_mb + num_index_copies * index_mb + MODULES_MEMORY_MB
+
+
+class RecipeRun:
+    """Measurements of a recipe run: wall-clock time, memory used on top of the process baseline and API calls"""
+
+    def __init__(self, seconds, peak_memory_mb, api_calls):
+        self.seconds = seconds
+        self.peak_memory_mb = peak_memory_mb
+        self.api_calls = api_calls
+
+    def rows_per_second(self, num_rows):
+        return num_rows / max(self.seconds, 1e-9)
+
+
+def write_embeddings_dataset(root, name, num_rows, num_dimensions, partition=None, group_size=None, random_seed=0):
+    """Write a CSV dataset of ids and JSON-encoded embeddings by blocks, with an optional contiguous group column
+
+    Returns:
+        Embeddings as a numpy array, rounded as written
+    """
+    dataset_path = os.path.join(root, "datasets", name)
+    os.makedirs(os.path.dirname(dataset_path), exist_ok=True)
+    if partition is not None:
+        os.makedirs(dataset_path, exist_ok=True)
+        csv_path = os.path.join(dataset_path, f"{partition}.csv")
+    else:
+        csv_path = f"{dataset_path}.csv"
+    schema = [{"name": "id", "type": "string"}, {"name": "embedding", "type": "array"}]
+    if group_size:
+        schema.append({"name": "group", "type": "string"})
+    with open(f"{dataset_path}.schema.json", "w") as schema_file:
+        json.dump(schema, schema_file)
+    random_state = np.random.RandomState(random_seed)
+    embeddings = np.round(random_state.rand(num_rows, num_dimensions), 6).astype(np.float32)
+    with open(csv_path, "w", newline="") as csv_file:
+        for start in range(0, num_rows, WRITE_BLOCK_SIZE):
+            block = embeddings[start : (start + WRITE_BLOCK_SIZE)]  # noqa
+            row_numbers = np.arange(start, start + len(block))
+            columns = {
+                "id": [f"item_{i}" for i in row_numbers],
+                "embedding": ["[" + ",".join(row) + "]" for row in np.char.mod("%.6f", block)],
+            }
+            if group_size:
+                columns["group"] = [f"group_{i // group_size}" for i in row_numbers]
+            pd.DataFrame(columns).to_csv(csv_file, index=False, header=(start == 0))
+    return embeddings
+
+
+def read_output_dataset(root, name, partition=None):
+    dataset_path = os.path.join(root, "datasets", name)
+    return pd.read_csv(os.path.join(dataset_path, f"{partition}.csv") if partition else f"{dataset_path}.csv")
+
+
+def _run_recipe_in_process(recipe_name, root, context, connection):
+    """Target of the subprocess running a recipe, sending back measurements or the error traceback"""
+    try:
+        dataiku.configure(root, **context)
+        baseline_memory_mb = PerformanceTracker.get_current_rss_mb()
+        start = perf_counter()
+        runpy.run_path(os.path.join(PLUGIN_ROOT, "custom-recipes", recipe_name, "recipe.py"), run_name="__main__")
+        seconds = perf_counter() - start
+        peak_memory_mb = PerformanceTracker.get_peak_rss_mb() - baseline_memory_mb  # VmHWM, not inherited
+        connection.send(RecipeRun(seconds, peak_memory_mb, dict(dataiku.API_CALLS)))
+    except BaseException:
+        connection.send(traceback.format_exc())
+    finally:
+        connection.close()
+
+
+def run_recipe(recipe_name, root, **context):
+    """Run a recipe script as DSS would, with the context passed to `dataiku.configure`
+
+    Each run uses a fresh Python process, so that module-level caches are empty and peak memory is its own.
+    """
+    multiprocessing_context = multiprocessing.get_context("spawn")
+    (parent_connection, child_connection) = multiprocessing_context.Pipe(duplex=False)
+    process = multiprocessing_context.Process(
+        target=_run_recipe_in_process, args=(recipe_name, root, context, child_connection)
+    )
+    process.start()
+    child_connection.close()
+    result = parent_connection.recv()
+    process.join()
+    if not isinstance(result, RecipeRun):
+        raise RuntimeError(f"Recipe {recipe_name} failed:\n{result}")
+    return result
+
+
+def read_performance_report(root, folder_name, folder_partition_root=""):
+    report_path = os.path.join(root, "folders", folder_name, folder_partition_root, "performance_report.json")
+    with open(report_path) as report_file:
+        return json.load(report_file)
@@ -0,0 +1,41 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import dataiku
+from dku_io_utils import ArtifactWriter, download_file_from_folder_to_tmp, read_manifest
+
+
+def test_manifest_round_trip_and_verification(tmp_path):
+    dataiku.configure(str(tmp_path))
+    folder = dataiku.Folder("index")
+    assert read_manifest(folder) == {}  # index folders built before manifests existed
+    arrays = np.random.RandomState(0).rand(100, 8).astype(np.float32)
+    with ArtifactWriter(folder) as writer:
+        writer.save_array(arrays, "vectors.npz")
+        writer.upload_bytes(b"index", "index.nns")
+    manifest = read_manifest(folder)
+    assert set(manifest) == {"vectors.npz", "index.nns"} and manifest["index.nns"]["size"] == 5
+    with download_file_from_folder_to_tmp("vectors.npz", folder, manifest["vectors.npz"]) as tmp:
+        assert np.array_equal(np.load(tmp.name)["arr_0"], arrays)
+    with open(os.path.join(folder.get_path(), "index.nns"), "wb") as index_file:
+        index_file.write(b"corrupted")
+    with pytest.raises(ValueError, match="corrupted"):
+        download_file_from_folder_to_tmp("index.nns", folder, manifest["index.nns"])
+    with open(os.path.join(folder.get_path(), ArtifactWriter.MANIFEST_FILE_NAME), "w") as manifest_file:
+        manifest_file.write("{")
+    with pytest.raises(json.JSONDecodeError):
+        read_manifest(folder)  # an unreadable manifest is not mistaken for a missing one
+
+
+def test_no_manifest_and_threads_shut_down_on_error(tmp_path):
+    dataiku.configure(str(tmp_path))
+    folder = dataiku.Folder("index")
+    with pytest.raises(RuntimeError):
+        with ArtifactWriter(folder) as writer:
+            writer.upload_bytes(b"index", "index.nns")
+            raise RuntimeError("Index build failed")
+    assert writer.executor._shutdown
+    assert not os.path.exists(os.path.join(folder.get_path(), ArtifactWriter.MANIFEST_FILE_NAME))
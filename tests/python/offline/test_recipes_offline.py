@@ -0,0 +1,164 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from offline_harness import (
+    LARGE_NUM_ROWS,
+    MIN_ROWS_PER_SECOND,
+    NUM_DIMENSIONS,
+    NUM_ROWS,
+    get_max_memory_mb,
+    get_num_queries,
+    read_output_dataset,
+    read_performance_report,
+    run_recipe,
+    write_embeddings_dataset,
+)
+
+INDEX_CONFIG = {
+    "unique_id_column": "id",
+    "feature_columns": ["embedding"],
+    "algorithm": "faiss",
+    "faiss_index_type": "IndexFlatL2",
+    "faiss_lsh_num_bits": 4,
+    "performance_report": True,
+}
+QUERY_CONFIG = {"unique_id_column": "id", "feature_columns": ["embedding"], "num_neighbors": 5}
+MEMORY_BUDGET_MB = 256
+# Phases of the I/O path, as opposed to the index build and search which depend on the algorithm
+INDEX_IO_PHASES = ["dataset_read", "vector_parsing", "array_serialization"]
+QUERY_IO_PHASES = ["dataset_read", "vector_parsing", "dataframe_assembly", "dataset_write"]
+
+
+def format_phases(phases):
+    return ", ".join(f"{name} {phase['seconds']:.2f}s" for name, phase in phases.items())
+
+
+def build_index(root, **context):
+    return run_recipe(
+        "similarity-search-index",
+        root,
+        recipe_config=INDEX_CONFIG,
+        inputs={"input_dataset": ["vectors"]},
+        outputs={"index_folder": ["index"]},
+        **context,
+    )
+
+
+@pytest.mark.parametrize(
+    "num_rows", [NUM_ROWS, pytest.param(LARGE_NUM_ROWS, marks=pytest.mark.large)], ids=["default", "large"]
+)
+def test_index_and_query_end_to_end(tmp_path, num_rows):
+    root = str(tmp_path)
+    num_queries = get_num_queries(num_rows)
+    write_embeddings_dataset(root, "vectors", num_rows, NUM_DIMENSIONS)
+    write_embeddings_dataset(root, "queries", num_queries, NUM_DIMENSIONS)  # same seed: first rows of the index
+    index_run = run_recipe(
+        "similarity-search-index",
+        root,
+        recipe_config={**INDEX_CONFIG, "expert": True, "out_of_core": True, "memory_budget_mb": MEMORY_BUDGET_MB},
+        inputs={"input_dataset": ["vectors"]},
+        outputs={"index_folder": ["index"]},
+    )
+    index_folder_path = os.path.join(root, "folders", "index")
+    with open(os.path.join(index_folder_path, "manifest.json")) as manifest_file:
+        manifest = json.load(manifest_file)["files"]
+    assert set(manifest) == {"index.nns", "vector_ids.npz", "vectors.npz"}
+    for file_name, file_info in manifest.items():
+        assert os.path.getsize(os.path.join(index_folder_path, file_name)) == file_info["size"]
+    assert os.path.exists(os.path.join(index_folder_path, "performance_report.json"))
+
+    query_run = run_recipe(
+        "similarity-search-query",
+        root,
+        recipe_config={
+            **QUERY_CONFIG,
+            "performance_report": True,
+            "adaptive_chunking": True,
+            "memory_budget_mb": MEMORY_BUDGET_MB,
+        },
+        inputs={"index_folder": ["index"], "input_dataset": ["queries"]},
+        outputs={"output_dataset": ["neighbors"], "report_folder": ["reports"]},
+    )
+    output_df = read_output_dataset(root, "neighbors")
+    assert len(output_df.index) == num_queries * QUERY_CONFIG["num_neighbors"]
+    first_neighbors = output_df.groupby("input_id", sort=False).first()
+    assert (first_neighbors.index == first_neighbors["neighbor_id"]).all()
+    assert np.allclose(first_neighbors["distance"], 0.0, atol=1e-4)
+    assert query_run.api_calls.get("api_client", 0) <= 1
+
+    index_phases = read_performance_report(root, "index")["phases"]
+    query_phases = read_performance_report(root, "reports")["phases"]
+    print(
+        f"\nIndex recipe on {num_rows} rows: {index_run.seconds:.1f} seconds, {index_run.peak_memory_mb:.0f} MB, "
+        + f"phases {format_phases(index_phases)}\nQuery recipe on {num_queries} rows: {query_run.seconds:.1f} "
+        + f"seconds, {query_run.peak_memory_mb:.0f} MB, phases {format_phases(query_phases)}"
+    )
+    for phase_name in INDEX_IO_PHASES:
+        assert index_phases[phase_name]["items_per_second"] >= MIN_ROWS_PER_SECOND, phase_name
+    for phase_name in QUERY_IO_PHASES:
+        assert query_phases[phase_name]["items_per_second"] >= MIN_ROWS_PER_SECOND, phase_name
+    assert index_run.peak_memory_mb <= get_max_memory_mb(MEMORY_BUDGET_MB, num_rows, num_index_copies=2)
+    assert query_run.peak_memory_mb <= get_max_memory_mb(MEMORY_BUDGET_MB, num_rows)
+
+
+def test_in_memory_index_saves_input_vectors(tmp_path):
+    root = str(tmp_path)
+    embeddings = write_embeddings_dataset(root, "vectors", min(NUM_ROWS, 20000), NUM_DIMENSIONS)
+    build_index(root)
+    with np.load(os.path.join(root, "folders", "index", "vectors.npz")) as vectors_file:
+        assert np.array_equal(vectors_file["arr_0"], embeddings)
+
+
+def test_wide_and_grouped_query_output(tmp_path):
+    root = str(tmp_path)
+    write_embeddings_dataset(root, "vectors", 2000, NUM_DIMENSIONS)
+    write_embeddings_dataset(root, "queries", 300, NUM_DIMENSIONS, group_size=3)
+    build_index(root)
+    run_recipe(
+        "similarity-search-query",
+        root,
+        recipe_config={**QUERY_CONFIG, "output_format": "wide", "group_column": "group", "group_aggregation": "rrf"},
+        inputs={"index_folder": ["index"], "input_dataset": ["queries"]},
+        outputs={"output_dataset": ["neighbors"]},
+    )
+    output_df = read_output_dataset(root, "neighbors")
+    assert list(output_df.columns) == ["group_id", "neighbor_id", "score"]
+    assert len(output_df.index) == 100 and output_df["group_id"].is_unique
+    assert all(len(json.loads(neighbors)) == QUERY_CONFIG["num_neighbors"] for neighbors in output_df["neighbor_id"])
+    with open(os.path.join(root, "datasets", "neighbors.schema.json")) as schema_file:
+        schema = json.load(schema_file)
+    column_types = {column["name"]: (column["type"], column.get("arrayContent")) for column in schema}
+    assert column_types["neighbor_id"] == ("array", {"name": "", "type": "string"})
+    assert column_types["score"] == ("array", {"name": "", "type": "double"})
+    assert column_types["group_id"] == ("string", None)
+
+
+def test_partitioned_index_and_query(tmp_path):
+    root = str(tmp_path)
+    write_embeddings_dataset(root, "vectors", 1000, NUM_DIMENSIONS, partition="fr")
+    write_embeddings_dataset(root, "queries", 100, NUM_DIMENSIONS, partition="fr")
+    folder_partitioning = {
+        "index": {"dimensions": [{"name": "country", "type": "value"}], "filePathPattern": "%{country}/.*"}
+    }
+    build_index(
+        root,
+        flow_variables={"DKU_DST_country": "fr"},
+        read_partitions={"vectors": ["fr"]},
+        folder_partitioning=folder_partitioning,
+    )
+    assert os.path.exists(os.path.join(root, "folders", "index", "fr", "manifest.json"))
+    run_recipe(
+        "similarity-search-query",
+        root,
+        recipe_config=QUERY_CONFIG,
+        inputs={"index_folder": ["index"], "input_dataset": ["queries"]},
+        outputs={"output_dataset": ["neighbors"]},
+        flow_variables={"DKU_SRC_index_country": "fr"},
+        read_partitions={"index": ["fr"], "queries": ["fr"]},
+        write_partitions={"neighbors": "fr"},
+        folder_partitioning=folder_partitioning,
+    )
+    assert len(read_output_dataset(root, "neighbors", partition="fr").index) == 100 * QUERY_CONFIG["num_neighbors"]
@@ -0,0 +1,78 @@
+import multiprocessing
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import dataiku
+from data_loader import DataLoader
+from dku_io_utils import spill_dataset_to_memmap
+from offline_harness import write_embeddings_dataset
+from performance_tracking import PerformanceTracker
+
+
+def spill(root, memory_budget_mb):
+    dataset = dataiku.Dataset("vectors")
+    chunk_sizes = []
+    iter_dataframes = dataset.iter_dataframes
+
+    def recording_iter_dataframes(chunksize, **kwargs):
+        for df in iter_dataframes(chunksize=chunksize, **kwargs):
+            chunk_sizes.append(len(df.index))
+            yield df
+
+    dataset.iter_dataframes = recording_iter_dataframes
+    data_loader = DataLoader("id", ["embedding"])
+    (array_ids, arrays, chunksize) = spill_dataset_to_memmap(
+        dataset, ["id", "embedding"], data_loader, os.path.join(root, "vectors.f32"), memory_budget_mb
+    )
+    return (array_ids, arrays, chunksize, chunk_sizes)
+
+
+def measure_spill_peak_memory_mb(root, memory_budget_mb):
+    """Target of a fresh process spilling the dataset, returning its peak memory on top of the process baseline"""
+    dataiku.configure(root)
+    baseline_memory_mb = PerformanceTracker.get_current_rss_mb()
+    spill(root, memory_budget_mb)
+    return PerformanceTracker.get_peak_rss_mb() - baseline_memory_mb
+
+
+def test_spill_round_trip_by_chunks_sized_from_budget(tmp_path):
+    root = str(tmp_path)
+    dataiku.configure(root)
+    embeddings = write_embeddings_dataset(root, "vectors", 5000, 32)
+    (array_ids, arrays, chunksize, chunk_sizes) = spill(root, memory_budget_mb=1)
+    assert isinstance(arrays, np.memmap)
+    assert np.array_equal(arrays, embeddings)
+    assert list(array_ids) == [f"item_{i}" for i in range(5000)]
+    assert 100 < chunksize < 5000 and chunk_sizes == [chunksize] * (5000 // chunksize) + [5000 % chunksize]
+    (_, _, double_chunksize, _) = spill(root, memory_budget_mb=2)
+    assert double_chunksize > 2 * chunksize  # the decoding batch takes a fixed part of the budget
+    (_, _, minimum_chunksize, _) = spill(root, memory_budget_mb=0.001)
+    assert minimum_chunksize == 100
+
+
+def test_spill_raises_on_duplicate_ids_across_chunks(tmp_path):
+    root = str(tmp_path)
+    dataiku.configure(root)
+    write_embeddings_dataset(root, "vectors", 1000, 8)
+    csv_path = os.path.join(root, "datasets", "vectors.csv")
+    df = pd.read_csv(csv_path)
+    pd.concat([df, df.head(1)]).to_csv(csv_path, index=False)
+    with pytest.raises(ValueError, match="should be unique"):
+        spill(root, memory_budget_mb=0.001)
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/status"), reason="peak memory of a fresh process needs /proc")
+def test_spill_peak_memory_does_not_grow_with_rows(tmp_path):
+    memory_budget_mb = 32
+    peak_memory_mb = {}
+    for num_rows in (5000, 20000):
+        root = os.path.join(str(tmp_path), str(num_rows))
+        write_embeddings_dataset(root, "vectors", num_rows, 512)
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            peak_memory_mb[num_rows] = pool.apply(measure_spill_peak_memory_mb, (root, memory_budget_mb))
+    print(f"\nSpill peak memory with a budget of {memory_budget_mb} MB: {peak_memory_mb}")
+    assert peak_memory_mb[20000] <= memory_budget_mb
+    assert peak_memory_mb[20000] - peak_memory_mb[5000] <= memory_budget_mb / 4
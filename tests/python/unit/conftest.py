@@ -0,0 +1,32 @@
+"""Fixtures shared by unit tests"""
+
+from tempfile import NamedTemporaryFile
+
+import pytest
+
+from nearest_neighbor.base import NearestNeighborSearch
+
+
+@pytest.fixture
+def faiss_params():
+    """Parameters of an exact Faiss index, whose neighbors are deterministic"""
+    return {"algorithm": "faiss", "faiss_index_type": "IndexFlatL2", "faiss_lsh_num_bits": 4}
+
+
+@pytest.fixture
+def build_index(faiss_params):
+    """Factory building an index on arrays, saved to `index_path` if given or else to a temporary file
+
+    Keyword arguments override the parameters of the exact Faiss index.
+    """
+
+    def build(arrays, index_path=None, **params):
+        nearest_neighbor = NearestNeighborSearch(num_dimensions=arrays.shape[1], **{**faiss_params, **params})
+        if index_path is not None:
+            nearest_neighbor.build_save_index(arrays=arrays, index_path=index_path)
+        else:
+            with NamedTemporaryFile() as tmp:
+                nearest_neighbor.build_save_index(arrays=arrays, index_path=tmp.name)
+        return nearest_neighbor
+
+    return build
@@ -0,0 +1,79 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from chunk_scheduler import AdaptiveChunkScheduler
+from performance_tracking import performance_tracker
+
+
+def test_iter_chunks_follows_chunksize():
+    scheduler = AdaptiveChunkScheduler(initial_chunksize=300)
+    df_iterator = (pd.DataFrame({"id": range(start, start + 250)}) for start in range(0, 1000, 250))
+    chunks = []
+    for df in scheduler.iter_chunks(df_iterator):
+        chunks.append(df)
+        scheduler.chunksize = 200 if len(chunks) == 1 else 450
+    assert [len(df.index) for df in chunks] == [300, 200, 450, 50]
+    assert list(pd.concat(chunks)["id"]) == list(range(1000))
+
+
+def test_grows_while_throughput_improves():
+    scheduler = AdaptiveChunkScheduler(initial_chunksize=1000, memory_budget_mb=1024)
+    assert scheduler.update(num_rows=1000, seconds=1.0, memory_mb=10) == 2000  # warm-up chunk
+    assert scheduler.update(num_rows=2000, seconds=1.0, memory_mb=20) == 4000
+    assert scheduler.update(num_rows=4000, seconds=1.0, memory_mb=40) == 8000
+    assert scheduler.update(num_rows=8000, seconds=2.0, memory_mb=80) == 4000  # no throughput gain
+    assert scheduler.converged
+    assert scheduler.update(num_rows=4000, seconds=0.5, memory_mb=40) == 4000
+    assert len(scheduler.history) == 5
+
+
+def test_shrinks_to_fit_memory_budget():
+    scheduler = AdaptiveChunkScheduler(initial_chunksize=1000, memory_budget_mb=100)
+    assert scheduler.update(num_rows=1000, seconds=1.0, memory_mb=80) == 1250  # capped by extrapolated memory
+    assert scheduler.update(num_rows=1250, seconds=1.0, memory_mb=200) == 625
+    assert scheduler.update(num_rows=100, seconds=1.0, memory_mb=1) == 625  # last partial chunk is ignored
+
+
+def test_recovers_after_memory_spike():
+    scheduler = AdaptiveChunkScheduler(initial_chunksize=1000, memory_budget_mb=100)
+    assert scheduler.update(num_rows=1000, seconds=1.0, memory_mb=10) == 2000
+    assert scheduler.update(num_rows=2000, seconds=1.0, memory_mb=20) == 4000
+    assert scheduler.update(num_rows=4000, seconds=2.0, memory_mb=40) == 2000
+    assert scheduler.converged
+    assert scheduler.update(num_rows=2000, seconds=1.0, memory_mb=400) == 500  # spike of memory per row
+    assert not scheduler.converged
+    assert scheduler.update(num_rows=500, seconds=0.25, memory_mb=5) == 1000
+    assert scheduler.update(num_rows=1000, seconds=0.4, memory_mb=10) == 2000
+    assert scheduler.update(num_rows=2000, seconds=0.7, memory_mb=20) == 4000
+    assert scheduler.update(num_rows=4000, seconds=2.0, memory_mb=40) == 2000
+    assert scheduler.converged
+
+
+def test_estimate_memory_mb_counts_strings():
+    df = pd.DataFrame({"id": range(1000), "embedding": ["[" + ",".join(["0.123456"] * 64) + "]"] * 1000})
+    memory_mb = AdaptiveChunkScheduler.estimate_memory_mb(df, df[["id"]])
+    assert memory_mb > 1000 * 64 * 9 / 1024 ** 2
+
+
+def test_estimate_memory_mb_counts_parsed_arrays_and_search_results(build_index):
+    arrays = np.random.RandomState(0).rand(2000, 64).astype(np.float32)
+    nearest_neighbor = build_index(arrays[:100])
+    df = pd.DataFrame({"id": range(2000), "embedding": [json.dumps(array.tolist()) for array in arrays]})
+    allocated_bytes = performance_tracker.allocated_bytes
+    output_df = nearest_neighbor.find_neighbors_df(df, "id", ["embedding"], np.arange(100), num_neighbors=10)
+    allocated_bytes = performance_tracker.allocated_bytes - allocated_bytes
+    assert allocated_bytes >= arrays.nbytes + 2000 * 10 * 12  # parsed vectors, neighbors and distances
+    dataframes_mb = AdaptiveChunkScheduler.estimate_memory_mb(df, output_df)
+    memory_mb = AdaptiveChunkScheduler.estimate_memory_mb(df, output_df, allocated_bytes=allocated_bytes)
+    assert memory_mb == dataframes_mb + allocated_bytes / 1024 ** 2
+
+
+def test_ignores_chunks_cut_short_by_a_group():
+    scheduler = AdaptiveChunkScheduler(initial_chunksize=1000)
+    scheduler.group_column = "product"
+    assert scheduler.update(num_rows=1000, seconds=1.0, memory_mb=10) == 2000
+    assert scheduler.update(num_rows=1500, seconds=0.5, memory_mb=15) == 4000  # cut at a change of group
+    assert scheduler.update(num_rows=1000, seconds=1.0, memory_mb=10) == 4000  # less than half: ignored
+    assert len(scheduler.history) == 3
@@ -0,0 +1,93 @@
+import json
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_loader import DataLoader
+
+
+def make_df(num_rows=10, array_length=4):
+    vectors = np.arange(num_rows * array_length, dtype=np.float32).reshape(num_rows, array_length)
+    return pd.DataFrame(
+        {
+            "id": [f"row_{i}" for i in range(num_rows)],
+            "embedding": [json.dumps(vector.tolist()) for vector in vectors],
+            "number": [str(float(i)) for i in range(num_rows)],
+        }
+    )
+
+
+def test_convert_numeric_and_array_columns():
+    df = make_df()
+    data_loader = DataLoader("id", ["embedding", "number"])
+    (array_ids, arrays) = data_loader.convert_df_to_arrays(df)
+    assert arrays.shape == (10, 5) and arrays.dtype == np.float32
+    assert list(arrays[2]) == [8.0, 9.0, 10.0, 11.0, 2.0]
+    assert list(array_ids[:2]) == ["row_0", "row_1"]
+    assert data_loader.column_kinds == {"embedding": "array", "number": "numeric"}
+
+
+def test_column_kinds_from_schema_are_reused_across_chunks():
+    schema = [
+        {"name": "id", "type": "string"},
+        {"name": "embedding", "type": "array"},
+        {"name": "number", "type": "double"},
+    ]
+    data_loader = DataLoader("id", ["embedding", "number"], input_schema=schema)
+    assert data_loader.column_kinds == {"embedding": "array", "number": "numeric"}
+    df = make_df(num_rows=20)
+    (_, first_arrays) = data_loader.convert_df_to_arrays(df.iloc[:10])
+    (_, second_arrays) = data_loader.convert_df_to_arrays(df.iloc[10:])
+    (_, all_arrays) = DataLoader("id", ["embedding", "number"]).convert_df_to_arrays(df)
+    assert np.array_equal(np.vstack([first_arrays, second_arrays]), all_arrays)
+
+
+@pytest.mark.parametrize(
+    "column,value,error_message",
+    [
+        ("embedding", None, "Empty values in column 'embedding'"),
+        ("embedding", "[1.0, 2.0]", "instead of length 4"),
+        ("embedding", "[1.0, 2.0, 3.0, oops]", "Invalid array data in column 'embedding'"),
+        ("number", None, "Empty values in column 'number'"),
+        ("number", "oops", "Invalid numeric data in column 'number'"),
+    ],
+)
+def test_invalid_values_are_detected_while_decoding(column, value, error_message):
+    df = make_df()
+    df.loc[5, column] = value
+    with pytest.raises(ValueError, match=error_message):
+        DataLoader("id", ["embedding", "number"]).convert_df_to_arrays(df)
+
+
+def test_duplicate_ids():
+    df = make_df()
+    df.loc[5, "id"] = "row_0"
+    with pytest.raises(ValueError, match="should be unique"):
+        DataLoader("id", ["embedding"]).convert_df_to_arrays(df)
+
+
+def test_array_column_is_decoded_by_batches(monkeypatch):
+    monkeypatch.setattr(DataLoader, "DECODE_BATCH_SIZE", 3)
+    df = make_df(num_rows=10)
+    (_, arrays) = DataLoader("id", ["embedding"]).convert_df_to_arrays(df)
+    assert np.array_equal(arrays, np.arange(40, dtype=np.float32).reshape(10, 4))
+    df.loc[8, "embedding"] = "[1.0]"
+    with pytest.raises(ValueError, match="instead of length 4"):
+        DataLoader("id", ["embedding"]).convert_df_to_arrays(df)
+
+
+def test_array_decoding_peak_memory():
+    random_state = np.random.RandomState(0)
+    vectors = random_state.rand(2000, 512).astype(np.float32)
+    df = pd.DataFrame({"id": range(2000), "embedding": [json.dumps(vector.tolist()) for vector in vectors]})
+    data_loader = DataLoader("id", ["embedding"])
+    tracemalloc.start()
+    try:
+        (_, arrays) = data_loader.convert_df_to_arrays(df, verbose=False)
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert np.array_equal(arrays, vectors)
+    assert peak_bytes < 2 * arrays.nbytes + 64 * DataLoader.DECODE_BATCH_SIZE * vectors.shape[1]
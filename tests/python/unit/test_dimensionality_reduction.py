@@ -0,0 +1,50 @@
+from tempfile import NamedTemporaryFile
+
+import numpy as np
+import pytest
+
+from dimensionality_reduction import DimensionalityReduction
+
+
+def make_low_rank_arrays(num_rows=2000, input_dimensions=64, rank=8):
+    random_state = np.random.RandomState(0)
+    latent = random_state.normal(size=(num_rows, rank))
+    return (latent @ random_state.normal(size=(rank, input_dimensions))).astype(np.float32)
+
+
+def test_pca_keeps_dimensions_from_target_explained_variance():
+    arrays = make_low_rank_arrays()
+    dimensionality_reduction = DimensionalityReduction("pca", target_explained_variance=0.999).fit(arrays)
+    assert dimensionality_reduction.output_dimensions <= 8
+    assert dimensionality_reduction.explained_variance >= 0.999
+    reduced_arrays = dimensionality_reduction.transform(arrays)
+    assert reduced_arrays.shape == (2000, dimensionality_reduction.output_dimensions)
+    assert reduced_arrays.dtype == np.float32
+
+
+def test_save_load_and_search_with_reduction(build_index):
+    arrays = make_low_rank_arrays()
+    dimensionality_reduction = DimensionalityReduction("random_projection", output_dimensions=16).fit(arrays)
+    with NamedTemporaryFile(suffix=".npz") as tmp:
+        dimensionality_reduction.save(tmp.name)
+        loaded = DimensionalityReduction.load(tmp.name)
+    assert np.array_equal(loaded.transform(arrays), dimensionality_reduction.transform(arrays))
+    nearest_neighbor = build_index(dimensionality_reduction.transform(arrays))
+    nearest_neighbor.dimensionality_reduction = loaded
+    assert nearest_neighbor.input_num_dimensions == 64
+    (neighbors, _) = nearest_neighbor.search_arrays(nearest_neighbor.transform_arrays(arrays[:5]), num_neighbors=1)
+    assert list(neighbors[:, 0]) == list(range(5))
+    with pytest.raises(ValueError, match="Incompatible number of dimensions"):
+        nearest_neighbor.transform_arrays(arrays[:5, :16])
+
+
+def test_pca_sample_sized_from_memory_budget():
+    assert DimensionalityReduction.get_sample_size(100000, 2048) == 2 ** 14
+    # 16k rows x 2048 dimensions would take 4 x 128 MB during the fit, above a quarter of the minimum budget
+    assert DimensionalityReduction.get_sample_size(100000, 2048, memory_budget_mb=64) == 1024
+    assert DimensionalityReduction.get_sample_size(100000, 64, memory_budget_mb=64) == 2 ** 14
+    arrays = make_low_rank_arrays()
+    dimensionality_reduction = DimensionalityReduction("pca", target_explained_variance=0.999)
+    dimensionality_reduction.fit(arrays, memory_budget_mb=0.001)
+    assert dimensionality_reduction.output_dimensions <= 8 and dimensionality_reduction.explained_variance >= 0.999
+    assert dimensionality_reduction.components.dtype == np.float32
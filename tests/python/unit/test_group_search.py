@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from chunk_scheduler import AdaptiveChunkScheduler
+from nearest_neighbor.group_search import GroupNearestNeighborSearch
+
+
+def make_group_search(build_index, aggregation):
+    arrays = np.array([[0.0, 0.0], [1.0, 0.0], [0.0, 1.0], [5.0, 5.0]], dtype=np.float32)
+    nearest_neighbor = build_index(arrays)
+    index_array_ids = np.array(["origin", "right", "up", "far"], dtype=object)
+    return GroupNearestNeighborSearch(nearest_neighbor, index_array_ids, "product", aggregation)
+
+
+def make_queries():
+    return pd.DataFrame(
+        {
+            "product": ["a", "a", "b"],
+            "embedding": ["[1.0, 0.1]", "[0.0, 0.9]", "[5.0, 4.0]"],
+        }
+    )
+
+
+@pytest.mark.parametrize("aggregation", ["min_distance", "mean_distance", "rrf"])
+def test_one_output_per_group_and_neighbor(build_index, aggregation):
+    group_search = make_group_search(build_index, aggregation)
+    output_df = group_search.find_neighbors_df(make_queries(), ["embedding"], num_neighbors=2)
+    assert list(output_df["group_id"]) == ["a", "a", "b", "b"]
+    assert not output_df.duplicated(["group_id", "neighbor_id"]).any()
+    expected_neighbors = {"origin", "right"} if aggregation == "rrf" else {"right", "up"}  # origin is 2nd twice
+    assert set(output_df[output_df["group_id"] == "a"]["neighbor_id"]) == expected_neighbors
+    assert list(output_df[output_df["group_id"] == "b"]["neighbor_id"])[0] == "far"
+    assert group_search.score_column_name in output_df.columns
+
+
+def test_aggregations(build_index):
+    (neighbors, distances) = (np.array([[1, 0], [2, 0]]), np.array([[0.1, 0.5], [0.2, 0.3]], dtype=np.float32))
+    group_codes = np.array([0, 0])
+    expected = {
+        "min_distance": ([[1, 2, 0]], [[0.1, 0.2, 0.3]]),
+        "mean_distance": ([[1, 2, 0]], [[0.1, 0.2, 0.4]]),
+        "rrf": ([[0, 1, 2]], [[2 / 62, 1 / 61, 1 / 61]]),
+    }
+    for aggregation, (expected_neighbors, expected_scores) in expected.items():
+        group_search = make_group_search(build_index, aggregation)
+        (top_neighbors, scores) = group_search.aggregate_neighbors(group_codes, 1, neighbors, distances, 3)
+        assert top_neighbors.tolist() == expected_neighbors
+        assert np.allclose(scores, expected_scores)
+
+
+def test_iter_chunks_keeps_groups_whole():
+    df = pd.DataFrame({"product": list("aaabbbbcdd"), "value": range(10)})
+    scheduler = AdaptiveChunkScheduler(initial_chunksize=4)
+    chunks = list(scheduler.iter_chunks((df.iloc[i : i + 3] for i in range(0, 10, 3)), group_column="product"))
+    assert [list(chunk["product"]) for chunk in chunks] == [list("aaa"), list("bbbb"), list("cdd")]
+
+
+def test_iter_chunks_raises_on_non_contiguous_groups():
+    df = pd.DataFrame({"product": list("aabbbbbba"), "value": range(9)})
+    scheduler = AdaptiveChunkScheduler(initial_chunksize=10)
+    with pytest.raises(ValueError, match="not contiguous in column 'product', e.g. 'a'"):
+        list(scheduler.iter_chunks(iter([df]), group_column="product"))
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+
+from nearest_neighbor.multi_index import MultiIndexNearestNeighborSearch
+
+
+def make_indices_and_queries(build_index):
+    random_state = np.random.RandomState(0)
+    (first_arrays, second_arrays) = (random_state.rand(30, 4).astype(np.float32) for _ in range(2))
+    indices = {
+        "catalog_fr": (build_index(first_arrays), np.array([f"fr_{i}" for i in range(30)], dtype=object)),
+        "catalog_us": (build_index(second_arrays), np.array([f"us_{i}" for i in range(30)], dtype=object)),
+    }
+    queries = np.vstack([first_arrays[:3], second_arrays[:3]])
+    df = pd.DataFrame({"id": [f"query_{i}" for i in range(6)], "embedding": [str(q.tolist()) for q in queries]})
+    return (indices, df)
+
+
+def test_separate_output(build_index):
+    (indices, df) = make_indices_and_queries(build_index)
+    with MultiIndexNearestNeighborSearch(indices, output_mode="separate") as multi_index_search:
+        output_df = multi_index_search.find_neighbors_df(df, "id", ["embedding"], num_neighbors=2)
+    assert multi_index_search._executor._shutdown
+    assert len(output_df.index) == 6 * 2 * 2
+    first_neighbors = output_df.groupby(["input_id", "index_name"])["neighbor_id"].first()
+    assert first_neighbors[("query_0", "catalog_fr")] == "fr_0"
+    assert first_neighbors[("query_3", "catalog_us")] == "us_0"
+
+
+def test_merged_output(build_index):
+    (indices, df) = make_indices_and_queries(build_index)
+    with MultiIndexNearestNeighborSearch(indices, output_mode="merged") as multi_index_search:
+        output_df = multi_index_search.find_neighbors_df(df, "id", ["embedding"], num_neighbors=3)
+    assert len(output_df.index) == 6 * 3
+    first_neighbor_ids = output_df.groupby("input_id")["neighbor_id"].first()
+    assert list(first_neighbor_ids) == ["fr_0", "fr_1", "fr_2", "us_0", "us_1", "us_2"]
+    assert (output_df.groupby("input_id")["distance"].apply(lambda d: d.is_monotonic_increasing)).all()
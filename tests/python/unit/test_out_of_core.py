@@ -0,0 +1,37 @@
+import os
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+
+import numpy as np
+import pytest
+
+from nearest_neighbor.base import NearestNeighborSearch
+from utils import iter_array_blocks
+
+
+def make_memmap(scratch_dir, arrays):
+    scratch_path = os.path.join(scratch_dir, "vectors.f32")
+    arrays.tofile(scratch_path)
+    return np.memmap(scratch_path, dtype=np.float32, mode="r", shape=arrays.shape)
+
+
+def test_iter_array_blocks_on_memmap():
+    arrays = np.random.RandomState(0).rand(1001, 8).astype(np.float32)
+    with TemporaryDirectory() as scratch_dir:
+        blocks = list(iter_array_blocks(make_memmap(scratch_dir, arrays), block_size=100))
+    assert [len(block) for block in blocks] == [100] * 10 + [1]
+    assert not any(isinstance(block, np.memmap) for block in blocks)
+    assert np.array_equal(np.vstack(blocks), arrays)
+
+
+@pytest.mark.parametrize("algorithm", ["faiss", "annoy"])
+def test_build_index_from_memmap_by_blocks(faiss_params, algorithm):
+    annoy_params = {"algorithm": "annoy", "annoy_metric": "euclidean", "annoy_num_trees": 10}
+    params = faiss_params if algorithm == "faiss" else annoy_params
+    arrays = np.random.RandomState(0).rand(500, 8).astype(np.float32)
+    with TemporaryDirectory() as scratch_dir, NamedTemporaryFile() as tmp:
+        nearest_neighbor = NearestNeighborSearch(num_dimensions=8, **params)
+        nearest_neighbor.build_save_index(arrays=make_memmap(scratch_dir, arrays), index_path=tmp.name, block_size=64)
+        nearest_neighbor = NearestNeighborSearch(**nearest_neighbor.get_config())
+        nearest_neighbor.load_index(tmp.name)
+        (neighbors, _) = nearest_neighbor.search_arrays(arrays[:10], num_neighbors=1)
+    assert list(neighbors[:, 0]) == list(range(10))
@@ -0,0 +1,89 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from nearest_neighbor.multi_index import MultiIndexNearestNeighborSearch
+from nearest_neighbor.output_format import build_output_df, encode_json_values, get_array_content_type
+
+
+def make_index_and_queries(build_index):
+    arrays = np.random.RandomState(0).rand(20, 4).astype(np.float32)
+    index_array_ids = np.array([f'item "{i}"' for i in range(20)], dtype=object)
+    df = pd.DataFrame({"id": [10, 11, 12], "embedding": [str(array.tolist()) for array in arrays[:3]]})
+    return (build_index(arrays), index_array_ids, df)
+
+
+def test_encode_json_values():
+    assert list(encode_json_values(np.array([1, -2]))) == [b"1", b"-2"]
+    assert list(encode_json_values(np.array([0.5, 2], dtype=np.float32))) == [b"0.5", b"2.0"]
+    assert list(encode_json_values(np.array(['a "b"', 3, "é"], dtype=object))) == [b'"a \\"b\\""', b"3", b'"\\u00e9"']
+
+
+def test_build_output_df_skips_padding():
+    columns = {"input_id": np.array(["a", "b"]), "neighbor_position": np.array([[4, 2], [7, -1]])}
+    found = np.array([[True, True], [True, False]])
+    long_df = build_output_df(columns, found, output_format="long")
+    assert long_df.to_dict("list") == {"input_id": ["a", "a", "b"], "neighbor_position": [4, 2, 7]}
+    wide_df = build_output_df(columns, found, output_format="wide")
+    assert wide_df.to_dict("list") == {"input_id": ["a", "b"], "neighbor_position": ["[4,2]", "[7]"]}
+    found[1, 0] = False
+    assert list(build_output_df(columns, found, output_format="wide")["neighbor_position"]) == ["[4,2]", "[]"]
+
+
+def test_get_array_content_type():
+    assert get_array_content_type(np.array([1, 2])) == "bigint"
+    assert get_array_content_type(np.array([1, 2], dtype=object)) == "bigint"
+    assert get_array_content_type(np.array([0.5], dtype=np.float32)) == "double"
+    assert get_array_content_type(np.array(["a", "b"], dtype=object)) == "string"
+
+
+def test_long_output_keeps_float64_distances(build_index):
+    (nearest_neighbor, index_array_ids, df) = make_index_and_queries(build_index)
+    long_df = nearest_neighbor.find_neighbors_df(df, "id", ["embedding"], index_array_ids, num_neighbors=3)
+    assert long_df["distance"].dtype == np.float64
+
+
+def test_wide_output_matches_long_output(build_index):
+    (nearest_neighbor, index_array_ids, df) = make_index_and_queries(build_index)
+    long_df = nearest_neighbor.find_neighbors_df(df, "id", ["embedding"], index_array_ids, num_neighbors=3)
+    wide_df = nearest_neighbor.find_neighbors_df(
+        df, "id", ["embedding"], index_array_ids, num_neighbors=3, output_format="wide"
+    )
+    assert len(long_df.index) == 9 and len(wide_df.index) == 3
+    assert list(wide_df.columns) == ["input_id", "neighbor_id", "distance"]
+    for _, row in wide_df.iterrows():
+        long_rows = long_df[long_df["input_id"] == row["input_id"]]
+        assert json.loads(row["neighbor_id"]) == list(long_rows["neighbor_id"])
+        assert np.allclose(json.loads(row["distance"]), long_rows["distance"], atol=1e-6)
+
+
+def test_neighbor_positions(build_index):
+    (nearest_neighbor, index_array_ids, df) = make_index_and_queries(build_index)
+    output_df = nearest_neighbor.find_neighbors_df(
+        df, "id", ["embedding"], index_array_ids, num_neighbors=2, output_format="wide", neighbor_id_type="position"
+    )
+    assert [json.loads(positions)[0] for positions in output_df["neighbor_position"]] == [0, 1, 2]
+    assert "neighbor_position" in nearest_neighbor.get_column_descriptions("wide", "position")
+    assert nearest_neighbor.get_array_column_types(index_array_ids, "wide", "position") == {
+        "neighbor_position": "bigint",
+        "distance": "double",
+    }
+    assert nearest_neighbor.get_array_column_types(index_array_ids, "long", "position") == {}
+
+
+def test_multi_index_merged_wide_output(build_index):
+    (nearest_neighbor, index_array_ids, df) = make_index_and_queries(build_index)
+    indices = {"first": (nearest_neighbor, index_array_ids), "second": (nearest_neighbor, index_array_ids)}
+    with MultiIndexNearestNeighborSearch(indices, output_mode="merged") as multi_index_search:
+        output_df = multi_index_search.find_neighbors_df(
+            df, "id", ["embedding"], num_neighbors=2, output_format="wide"
+        )
+    assert len(output_df.index) == 3
+    assert json.loads(output_df["index_name"][0]) == ["first", "second"]
+    assert json.loads(output_df["neighbor_id"][0]) == ['item "0"', 'item "0"']
+    assert multi_index_search.get_array_column_types("wide") == {
+        "neighbor_id": "string",
+        "distance": "double",
+        "index_name": "string",
+    }
@@ -0,0 +1,59 @@
+import json
+import multiprocessing
+import os
+import pstats
+from tempfile import NamedTemporaryFile
+
+import numpy as np
+import pytest
+
+from performance_tracking import PerformanceTracker
+
+
+def test_phase_accumulates_calls_and_items():
+    tracker = PerformanceTracker()
+    for _ in range(3):
+        with tracker.phase("vector_parsing", num_items=100):
+            sum(range(10000))
+    tracker.record("search", 0.5, num_items=1000)
+    report = tracker.get_report()
+    assert report["phases"]["vector_parsing"]["calls"] == 3
+    assert report["phases"]["vector_parsing"]["items"] == 300
+    assert report["phases"]["search"]["items_per_second"] == 2000.0
+    assert report["peak_rss_mb"] > 0
+    assert json.loads(json.dumps(report)) == report
+
+
+def test_reset_clears_phases():
+    tracker = PerformanceTracker()
+    tracker.record("upload", 1.0)
+    tracker.record_allocation(1024)
+    assert tracker.allocated_bytes == 1024
+    tracker.reset(recipe_name="similarity-search-query")
+    report = tracker.get_report()
+    assert report["recipe"] == "similarity-search-query"
+    assert report["phases"] == {}
+    assert report["phases"].get("upload") is None
+    assert tracker.allocated_bytes == 0
+
+
+def test_profiling_dump():
+    tracker = PerformanceTracker()
+    tracker.start_profiling()
+    sorted(range(10000), reverse=True)
+    with NamedTemporaryFile(suffix=".prof") as tmp:
+        tracker.stop_profiling(tmp.name)
+        stats = pstats.Stats(tmp.name)
+        assert stats.total_calls > 0
+    assert tracker.profiler is None
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/status"), reason="VmHWM is only available in /proc on Linux")
+def test_peak_rss_is_not_inherited_from_parent_process():
+    data = np.ones(2 ** 28 // 8)  # touch 256 MB in this process
+    parent_peak_rss_mb = PerformanceTracker.get_peak_rss_mb()
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        child_peak_rss_mb = pool.apply(PerformanceTracker.get_peak_rss_mb)
+    del data
+    assert parent_peak_rss_mb >= 256
+    assert child_peak_rss_mb < parent_peak_rss_mb - 200
@@ -0,0 +1,127 @@
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import pytest
+
+from query_server import NeighborQueryService, make_server
+
+
+@pytest.fixture
+def build_local_index(build_index):
+    """Factory writing a local index folder as produced by the index recipe"""
+
+    def build(index_path, arrays, array_ids):
+        nearest_neighbor = build_index(arrays, index_path=os.path.join(index_path, "index.nns"))
+        np.savez_compressed(os.path.join(index_path, nearest_neighbor.ARRAY_IDS_FILE_NAME), array_ids)
+        with open(os.path.join(index_path, nearest_neighbor.CONFIG_FILE_NAME), "w") as config_file:
+            json.dump(nearest_neighbor.get_config(), config_file)
+
+    return build
+
+
+def post_json(url, body):
+    request = urllib.request.Request(url, data=json.dumps(body).encode("utf-8"), method="POST")
+    try:
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return {"status": e.code, **json.loads(e.read())}
+
+
+def test_concurrent_queries_are_batched(build_local_index):
+    arrays = np.random.RandomState(0).rand(100, 8).astype(np.float32)
+    array_ids = np.array([f"item_{i}" for i in range(100)], dtype=object)
+    with TemporaryDirectory() as index_path:
+        build_local_index(index_path, arrays, array_ids)
+        with NeighborQueryService(index_path, max_batch_size=64, max_wait_seconds=0.01) as service:
+            with ThreadPoolExecutor(max_workers=16) as executor:
+                results = list(executor.map(lambda i: service.query(arrays[i], num_neighbors=1 + i % 3), range(32)))
+    for i, result in enumerate(results):
+        assert len(result) == 1 and len(result[0]) == 1 + i % 3
+        assert result[0][0]["id"] == f"item_{i}"
+
+
+def test_http_search_and_hot_swap(build_local_index):
+    arrays = np.random.RandomState(0).rand(50, 4).astype(np.float32)
+    with TemporaryDirectory() as reload_root:
+        (first_index_path, second_index_path) = (os.path.join(reload_root, "v1"), os.path.join(reload_root, "v2"))
+        for index_path in (first_index_path, second_index_path):
+            os.makedirs(index_path)
+        build_local_index(first_index_path, arrays, np.arange(50))
+        build_local_index(second_index_path, arrays, np.arange(50) + 1000)
+        service = NeighborQueryService(first_index_path)
+        server = make_server(service, port=0, reload_root=reload_root)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}"
+        try:
+            response = post_json(f"{url}/search", {"vectors": arrays[:2].tolist(), "num_neighbors": 3})
+            assert response["index_version"] == 1
+            assert [neighbors[0]["id"] for neighbors in response["neighbors"]] == [0, 1]
+            assert post_json(f"{url}/reload", {"index_path": "v2"})["index_version"] == 2
+            response = post_json(f"{url}/search", {"vectors": arrays[:2].tolist(), "num_neighbors": 3})
+            assert response["index_version"] == 2
+            assert [neighbors[0]["id"] for neighbors in response["neighbors"]] == [1000, 1001]
+            for num_neighbors in [0, -3, 1.5, "3"]:
+                response = post_json(f"{url}/search", {"vectors": arrays[:2].tolist(), "num_neighbors": num_neighbors})
+                assert response["status"] == 400 and "Invalid number of neighbors" in response["error"]
+            for index_path in ["..", "v2/../..", "/tmp", reload_root]:
+                response = post_json(f"{url}/reload", {"index_path": index_path})
+                assert response["status"] == 400 and "not a subdirectory" in response["error"]
+            response = post_json(f"{url}/search", [1, 2])
+            assert response["status"] == 400 and "JSON object" in response["error"]
+        finally:
+            server.shutdown()
+            server.server_close()
+            service.close()
+
+
+def test_invalid_queries_do_not_fail_other_queries(build_local_index):
+    arrays = np.random.RandomState(0).rand(20, 4).astype(np.float32)
+    with TemporaryDirectory() as index_path:
+        build_local_index(index_path, arrays, np.arange(20))
+        with NeighborQueryService(index_path, max_wait_seconds=0.05) as service:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                valid_query = executor.submit(service.query, arrays[:3], 2)
+                invalid_query = executor.submit(service.query, arrays[:3, :3], 2)
+                assert [neighbors[0]["id"] for neighbors in valid_query.result()] == [0, 1, 2]
+                with pytest.raises(ValueError, match="Incompatible number of dimensions"):
+                    invalid_query.result()
+            (nearest_neighbor, index_array_ids, index_version) = service._index
+            service._index = (nearest_neighbor, [], index_version)  # result assembly fails on missing ids
+            with pytest.raises(IndexError):
+                service.query(arrays[:1], timeout=5)
+            service._index = (nearest_neighbor, index_array_ids, index_version)
+            assert service.query(arrays[:1], timeout=5)[0][0]["id"] == 0
+        assert not service._worker.is_alive()
+        with pytest.raises(RuntimeError, match="closed"):
+            service.query(arrays[:1])
+
+
+def test_http_reload_is_disabled_by_default_and_timeouts_are_unavailable(build_local_index, monkeypatch):
+    arrays = np.random.RandomState(0).rand(10, 4).astype(np.float32)
+    with TemporaryDirectory() as index_path:
+        build_local_index(index_path, arrays, np.arange(10))
+        service = NeighborQueryService(index_path)
+        server = make_server(service, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}"
+        try:
+            response = post_json(f"{url}/reload", {"index_path": index_path})
+            assert response["status"] == 403 and service.index_version == 1
+
+            def time_out(*args, **kwargs):
+                raise FutureTimeoutError()
+
+            monkeypatch.setattr(service, "query_with_version", time_out)
+            response = post_json(f"{url}/search", {"vectors": arrays[:1].tolist()})
+            assert response["status"] == 503
+        finally:
+            server.shutdown()
+            server.server_close()
+            service.close()